@@ -0,0 +1,85 @@
+# Resolving the hits of a tick together (World._resolve_attacks) against
+# calling Dodger.dodge and DamanageAccepter.on_damage per hit, as
+# AttackEffect did before, for 5 ticks of 50 units all hitting each other:
+#   python benchmarks/bench_attacks.py
+from __future__ import annotations
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from luluwaku.core import *
+
+UNITS = 50
+TICKS = 5
+
+
+class Fighter(Entity):
+    __components__ = (Unit, Board, DamanageAccepter, Dodger)
+
+
+def build() -> tuple[World, list[Unit]]:
+    world = World(seed=0)
+    units = []
+    for n in range(UNITS):
+        fighter = Fighter(world)
+        unit = fighter[Unit]
+        unit.uname = f"u{n}"
+        Group(unit, unit.uname)
+        board = fighter[Board]
+        board.apply_CON(1e9)
+        board.apply_SPR(n % 7)
+        board.apply_DEX(n % 5)
+        board.apply_HP(board.MAX_HP)
+        fighter[Dodger], fighter[DamanageAccepter]
+        units.append(unit)
+    return world, units
+
+
+def hits(units: list[Unit]):
+    for a in units:
+        for t in units:
+            if a is not t:
+                yield a, t, Damage(focus=5, physical_damage=3, real_damage=1)
+
+
+def batched() -> list[float]:
+    world, units = build()
+    for _ in range(TICKS):
+        for a, t, damage in hits(units):
+            world.intend_attack(a, t, damage)
+        world.judge()
+    return [u[Board].HP for u in units]
+
+
+def scalar() -> list[float]:
+    world, units = build()
+    for _ in range(TICKS):
+        for a, t, damage in hits(units):
+            da = t.get_component(DamanageAccepter)
+            if not da:
+                continue
+            if dodger := t.get_component(Dodger):
+                if dodger.dodge(a, damage):
+                    continue
+            da.on_damage(a, damage)
+        world.judge()
+    return [u[Board].HP for u in units]
+
+
+def main():
+    print(f"{TICKS} ticks of {UNITS * (UNITS - 1)} hits")
+    results = []
+    for name, run in (("batched", batched), ("scalar", scalar)):
+        best = float("inf")
+        for _ in range(20):
+            t = time.perf_counter()
+            result = run()
+            best = min(best, time.perf_counter() - t)
+        results.append(result)
+        print(f"  {name:<8} {best * 1e3:8.1f} ms")
+    assert results[0] == results[1]
+
+
+if __name__ == "__main__":
+    main()
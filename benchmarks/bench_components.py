@@ -0,0 +1,50 @@
+# Run with both interpreters to compare, e.g.
+#   python benchmarks/bench_components.py
+#   pypy3 benchmarks/bench_components.py
+from __future__ import annotations
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from luluwaku.core import *
+
+N = 200_000
+
+
+class Soldier(Entity):
+    __components__ = (Unit, Board, Positional, DamanageAccepter, Dodger, Caster, Bag)
+
+
+def scan_lookup(metadata: Metadata, components: list, t: type):
+    # the lookup as it was before slot tables: walk every candidate slot
+    indices = metadata.indices.get(t, None)
+    if indices is not None:
+        for i in indices:
+            o = components[i]
+            if isinstance(o, t):
+                return o
+    return None
+
+
+def main():
+    e = Soldier()
+    e[Unit], e[Board], e[Bag]
+    metadata = Soldier.__metadata__
+    components = e.components
+    get_board = metadata.accessors[Board]
+    cases = {
+        "scan (before)": lambda: scan_lookup(metadata, components, Board),
+        "get_component": lambda: e.get_component(Board),
+        "__getitem__": lambda: e[Board],
+        "accessor": lambda: get_board(e),
+    }
+    print(f"{platform.python_implementation()} {platform.python_version()}, {N} lookups")
+    for name, f in cases.items():
+        best = min(timeit.repeat(f, number=N, repeat=5))
+        print(f"  {name:<16} {best * 1e9 / N:8.1f} ns/lookup")
+
+
+if __name__ == "__main__":
+    main()
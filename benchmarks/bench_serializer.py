@@ -0,0 +1,87 @@
+# Compares snapshot records (snapshot.dumps) with pickling the whole world
+# with dill (or pickle) on a 200x200 map holding 1k units, some of them with
+# closures as death listeners, and times the delta written after a tick that
+# moves 10 units:
+#   python benchmarks/bench_serializer.py
+from __future__ import annotations
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from luluwaku.core import *
+from luluwaku import snapshot
+
+try:
+    import dill as baseline
+except ImportError:
+    import pickle as baseline
+
+SIZE = 200
+UNITS = 1000
+
+
+class Land(Entity):
+    __components__ = (Map,)
+
+
+class Soldier(Entity):
+    __components__ = (Unit, Board, Positional, DamanageAccepter, Caster, Bag)
+
+
+def build() -> World:
+    rng = random.Random(0)
+    world = World(seed=0)
+    m = Map(SIZE, SIZE, "bench", Land(world))
+    for i in range(SIZE):
+        for j in range(SIZE):
+            m[i, j].pass_consumption = rng.randint(1, 3)
+    for n in range(UNITS):
+        soldier = Soldier(world)
+        unit = soldier[Unit]
+        unit.uname = f"u{n}"
+        board = soldier[Board]
+        board.apply_CON(rng.uniform(5, 20))
+        board.apply_SPR(rng.uniform(5, 20))
+        board.apply_HP(board.MAX_HP)
+        soldier[Bag].add_money(rng.randint(0, 1000))
+        Positional(m, unit).set_pos(rng.randrange(SIZE), rng.randrange(SIZE))
+        if n % 10 == 0:
+            board.on_death += lambda unit=unit: unit.world.log(f"{unit.uname} died")
+    return world
+
+
+def measure(name: str, dump, load, world: World):
+    t = time.perf_counter()
+    data = dump(world)
+    t_dump = time.perf_counter() - t
+    t = time.perf_counter()
+    load(data)
+    t_load = time.perf_counter() - t
+    print(f"  {name:<12} {len(data) / 1024:9.1f} KiB  dump {t_dump * 1e3:8.1f} ms  load {t_load * 1e3:8.1f} ms")
+
+
+def main():
+    world = build()
+    print(f"{SIZE}x{SIZE} map, {UNITS} units")
+    measure("snapshot", snapshot.dumps, snapshot.loads, world)
+    measure(baseline.__name__, baseline.dumps, baseline.loads, world)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = snapshot.SnapshotWriter(world, os.path.join(tmp, "save"))
+        soldiers = [e for e in world.entities.values() if isinstance(e, Soldier)]
+        for soldier in soldiers[:10]:
+            pos = soldier[Positional]
+            pos.set_pos((pos._X + 1) % SIZE, pos._Y)
+        t = time.perf_counter()
+        world.judge()
+        writer.write_delta()
+        t_delta = time.perf_counter() - t
+        print(f"  {'delta':<12} {writer.delta_size / 1024:9.1f} KiB  tick+write {t_delta * 1e3:8.1f} ms")
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -25,5 +25,5 @@ class NormalAttack(Effect):
             _create_normal_atk,
             distance=self.emitter[Board].ATTACK_DIST,
             aoe=0,
-        ).submit()
+        ).submit(self.world)
         return False
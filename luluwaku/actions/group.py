@@ -9,8 +9,8 @@ class Create(Effect):
         self.name = name
 
     def on_step(self) -> bool:
-        if self.name in GameState.groups:
-            GameState.log(f"队伍【{self.name}】已成立，创建失败", self.emitter.uname)
+        if self.name in self.world.groups:
+            self.world.log(f"队伍【{self.name}】已成立，创建失败", self.emitter.uname)
             return False
         Group.leave(self.emitter)
         Group(self.emitter, self.name)
@@ -29,24 +29,27 @@ class Leave(Effect):
 
 @typing.final
 class Join(Effect):
+    __index_keys__ = ("name", "requester")
+
     def __init__(self, emitter: Unit, name: str):
         self.emitter = emitter
         self.name = name
+        self.requester = emitter.uname
         self.agreed: typing.Literal["pending", "refused", "agreed"] = "pending"
 
     def on_step(self) -> bool:
-        if self.name not in GameState.groups:
-            GameState.log(f"队伍【{self.name}】不存在，加入失败", self.emitter.uname)
+        if self.name not in self.world.groups:
+            self.world.log(f"队伍【{self.name}】不存在，加入失败", self.emitter.uname)
             return False
         if self.agreed == "pending":
-            return True
+            return self.wait(("join", self.name, self.requester), ("group", self.name))
         if self.agreed == "refused":
             return False
         if self.agreed != "agreed":
-            GameState.log(f"队伍【{self.name}】加入失败，未知错误", self.emitter.uname)
+            self.world.log(f"队伍【{self.name}】加入失败，未知错误", self.emitter.uname)
             return False
         Group.leave(self.emitter)
-        g = GameState.groups[self.name]
+        g = self.world.groups[self.name]
         Group.join(self.emitter, g)
         return False
 
@@ -60,24 +63,16 @@ class ResponseJoin(Effect):
         self.requester = requester
 
     def on_step(self) -> bool:
-        if self.name not in GameState.groups:
-            GameState.log(f"队伍【{self.name}】不存在，处理失败", self.emitter.uname)
+        if self.name not in self.world.groups:
+            self.world.log(f"队伍【{self.name}】不存在，处理失败", self.emitter.uname)
             return False
-        group = GameState.groups[self.name]
+        group = self.world.groups[self.name]
         if self.emitter is not group.owner:
-            GameState.log(f"不是队伍【{self.name}】的队长，无法处理申请", self.emitter.uname)
+            self.world.log(f"不是队伍【{self.name}】的队长，无法处理申请", self.emitter.uname)
             return False
 
-        def cond(e: Effect) -> bool:
-            if not isinstance(e, Join):
-                return False
-            if e.name != self.name:
-                return False
-            if e.emitter.uname != self.requester:
-                return False
-            return True
-
-        for eff in GameState.matching_effects(cond):
-            typing.cast(Join, eff).agreed = "agreed" if self.agreed else "refused"
-            break
+        join = self.world.find_effect(Join, (self.name, self.requester))
+        if join is not None:
+            join.agreed = "agreed" if self.agreed else "refused"
+            self.world.signal(("join", self.name, self.requester))
         return False
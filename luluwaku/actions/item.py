@@ -15,7 +15,7 @@ class Activate(Effect):
 
     def on_step(self) -> bool:
         if not self.emitter[Bag].has_item(self.item):
-            GameState.log(f"物品【{self.item.name}】不在背包中，无法使用", self.emitter.uname)
+            self.world.log(f"物品【{self.item.name}】不在背包中，无法使用", self.emitter.uname)
             return False
         if self.emitter[Board].consume_efforts(self.item.activation_consumption):
             self.item.on_activated(self.emitter, self.target)
@@ -31,7 +31,7 @@ class Deactivate(Effect):
 
     def on_step(self) -> bool:
         if not self.emitter[Bag].has_item(self.item):
-            GameState.log(f"物品【{self.item.name}】不在背包中，无法停用", self.emitter.uname)
+            self.world.log(f"物品【{self.item.name}】不在背包中，无法停用", self.emitter.uname)
             return False
         self.item.on_deactivated(self.emitter)
         return False
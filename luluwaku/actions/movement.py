@@ -20,34 +20,19 @@ class MoveTo(Effect):
             return False
 
         limit = status.DEX * 0.3 + status.SPR * 0.05 + status.CON * 0.1
-        finalX = pos._X + dx * limit / dist
-        finalY = pos._Y + dy * limit / dist
-
+        # units heading to the same target share one flow field
+        field = pos.map.flow_field(self.target)
         x = pos._X
         y = pos._Y
-
-        if abs(dx) > abs(dy):
-            dx_unit = sign(dx)
-            k = dy / dx
-            while x < finalX:
-                x += dx_unit
-                y += k * dx_unit
-                cell = pos.map.find_cell_at_point(int(x), int(y))
-                if cell and status.consume_efforts(cell.pass_consumption):
-                    pos.set_pos(int(x), int(y))
-                else:
-                    break
-        else:
-            dy_unit = sign(dy)
-            k = dx / dy
-            while y < finalY:
-                y += dy_unit
-                x += k * dy_unit
-                cell = pos.map.find_cell_at_point(int(x), int(y))
-                if cell and status.consume_efforts(cell.pass_consumption):
-                    pos.set_pos(int(x), int(y))
-                else:
-                    break
+        path = []
+        for _ in range(int(limit)):
+            step = field.next_step(x, y)
+            if step is None:
+                break
+            path.append(step)
+            x, y = step
+        # moved together with the other units at the end of the judge
+        self.world.intend_move(pos, path, status)
         return False
 
 
@@ -2,8 +2,6 @@ from __future__ import annotations
 from luluwaku.core import *
 import uuid
 
-from luluwaku.core import _GameStateType
-
 
 class Data:
     money: int
@@ -11,7 +9,7 @@ class Data:
 
 
 # TODO
-def create_ticket_id(g: _GameStateType) -> str:
+def create_ticket_id(g: World) -> str:
     return str(uuid.uuid4())
 
 
@@ -24,18 +22,15 @@ class Cancel(Effect):
         self.ticket_id = ticket_id
 
     def on_step(self) -> bool:
-        transacs = GameState.matching_effects(
-            lambda eff: isinstance(eff, Create) and eff.ticket_id == self.ticket_id
-        )
-        for transac in transacs:
-            transac = typing.cast(Create, transac)
+        transac = self.world.find_effect(Create, self.ticket_id)
+        if transac is not None:
             transac.cancelled = True
-            GameState.log(
+            self.world.log(
                 f"交易【{transac.ticket_id}】已取消",
                 transac.emitter.uname,
                 transac.target.uname,
             )
-            break
+            self.world.signal(("transaction", self.ticket_id))
         return False
 
 
@@ -48,26 +43,25 @@ class Shake(Effect):
         self.ticket_id = ticket_id
 
     def on_step(self) -> bool:
-        transacs = GameState.matching_effects(
-            lambda eff: isinstance(eff, Create) and eff.ticket_id == self.ticket_id
-        )
-        for transac in transacs:
-            transac = typing.cast(Create, transac)
-            if transac.emitter is self.emitter:
-                transac.shaked_by_emitter = True
-                GameState.log(
-                    f"交易【{transac.ticket_id}】被甲方确认",
-                    transac.emitter.uname,
-                    transac.target.uname,
-                )
-            elif transac.target is self.emitter:
-                transac.shaked_by_target = True
-                GameState.log(
-                    f"交易【{transac.ticket_id}】被乙方确认",
-                    transac.emitter.uname,
-                    transac.target.uname,
-                )
+        transac = self.world.find_effect(Create, self.ticket_id)
+        if transac is None:
             return False
+        if transac.emitter is self.emitter:
+            transac.shaked_by_emitter = True
+            self.world.log(
+                f"交易【{transac.ticket_id}】被甲方确认",
+                transac.emitter.uname,
+                transac.target.uname,
+            )
+        elif transac.target is self.emitter:
+            transac.shaked_by_target = True
+            self.world.log(
+                f"交易【{transac.ticket_id}】被乙方确认",
+                transac.emitter.uname,
+                transac.target.uname,
+            )
+        if transac.shaked_by_emitter and transac.shaked_by_target:
+            self.world.signal(("transaction", self.ticket_id))
         return False
 
 
@@ -77,30 +71,28 @@ class ModMoney(Effect):
     money: int
     ask_other: bool
 
-    def __init__(self, emitter: Unit, money: int, ask_other: bool = True):
-        self.ticket_id = create_ticket_id(GameState)
+    def __init__(
+        self, emitter: Unit, ticket_id: str, money: int, ask_other: bool = True
+    ):
+        self.ticket_id = ticket_id
         self.emitter = emitter
         self.money = money
         self.ask_other = ask_other
 
     def on_step(self) -> bool:
-        transacs = GameState.matching_effects(
-            lambda eff: isinstance(eff, Create) and eff.ticket_id == self.ticket_id
+        transac = self.world.find_effect(Create, self.ticket_id)
+        if transac is None:
+            return False
+        if transac.emitter == self.emitter:
+            data = self.ask_other and transac.cost or transac.gain
+        elif transac.target == self.emitter:
+            data = self.ask_other and transac.gain or transac.cost
+        else:
+            return False
+        data.money = self.money
+        self.world.log(
+            f"交易【{transac.ticket_id}】金额设置为 {data.money}", self.emitter.uname
         )
-        for transac in transacs:
-            transac = typing.cast(Create, transac)
-            if transac.emitter == self.emitter:
-                data = self.ask_other and transac.cost or transac.gain
-            elif transac.target == self.emitter:
-                data = self.ask_other and transac.gain or transac.cost
-            else:
-                break
-            data.money = self.money
-            GameState.log(
-                f"交易【{transac.ticket_id}】金额设置为 {data.money}", self.emitter.uname
-            )
-            break
-
         return False
 
 
@@ -126,33 +118,31 @@ class ModItem(Effect):
         self.ask_other = ask_other
 
     def on_step(self) -> bool:
-        transacs = GameState.matching_effects(
-            lambda eff: isinstance(eff, Create) and eff.ticket_id == self.ticket_id
-        )
-
-        for transac in transacs:
-            transac = typing.cast(Create, transac)
-            if transac.emitter == self.emitter:
-                data = self.ask_other and transac.cost or transac.gain
-            elif transac.target == self.emitter:
-                data = self.ask_other and transac.gain or transac.cost
-            else:
-                break
-            if self.modifier == "add":
-                data.items.add(self.item)
-                GameState.log(
-                    f"交易【{transac.ticket_id}】添加物品 {self.item.name}", self.emitter.uname
-                )
-            elif self.modifier == "remove":
-                data.items.discard(self.item)
-                GameState.log(
-                    f"交易【{transac.ticket_id}】移除物品 {self.item.name}", self.emitter.uname
-                )
-            break
+        transac = self.world.find_effect(Create, self.ticket_id)
+        if transac is None:
+            return False
+        if transac.emitter == self.emitter:
+            data = self.ask_other and transac.cost or transac.gain
+        elif transac.target == self.emitter:
+            data = self.ask_other and transac.gain or transac.cost
+        else:
+            return False
+        if self.modifier == "add":
+            data.items.add(self.item)
+            self.world.log(
+                f"交易【{transac.ticket_id}】添加物品 {self.item.name}", self.emitter.uname
+            )
+        elif self.modifier == "remove":
+            data.items.discard(self.item)
+            self.world.log(
+                f"交易【{transac.ticket_id}】移除物品 {self.item.name}", self.emitter.uname
+            )
         return False
 
 
 class Create(Effect):
+    __index_keys__ = ("ticket_id",)
+
     emitter: Unit
     target: Unit
     ticket_id: str
@@ -167,7 +157,7 @@ class Create(Effect):
         self.target = target
         self.cost = cost
         self.gain = gain
-        self.ticket_id = create_ticket_id(GameState)
+        self.ticket_id = create_ticket_id(emitter.world)
 
         if not target[Board].alive:
             self.shaked_by_target = True
@@ -177,19 +167,19 @@ class Create(Effect):
             return False
 
         if not self.shaked_by_target or not self.shaked_by_emitter:
-            return True
+            return self.wait(("transaction", self.ticket_id))
 
         emitterBag = self.emitter[Bag]
         targetBag = self.target[Bag]
 
         if emitterBag.money < self.cost.money:
-            GameState.log(
+            self.world.log(
                 f"交易失败，{self.emitter.uname}的金钱不足", self.emitter.uname, self.target.uname
             )
             return False
 
         if targetBag.money < self.gain.money:
-            GameState.log(
+            self.world.log(
                 f"交易失败，【{self.target.uname}】的金钱不足",
                 self.emitter.uname,
                 self.target.uname,
@@ -201,7 +191,7 @@ class Create(Effect):
 
         for item in gain_items:
             if not targetBag.has_item(item):
-                GameState.log(
+                self.world.log(
                     f"交易失败，【{self.target.uname}】没有物品【{item.name}】",
                     self.emitter.uname,
                     self.target.uname,
@@ -210,7 +200,7 @@ class Create(Effect):
 
         for item in cost_items:
             if not emitterBag.has_item(item):
-                GameState.log(
+                self.world.log(
                     f"交易失败，【{self.emitter.uname}】没有物品【{item.name}】",
                     self.emitter.uname,
                     self.target.uname,
@@ -231,5 +221,5 @@ class Create(Effect):
             if targetBag.remove_item(item):
                 emitterBag.add_item(item)
 
-        GameState.log(f"交易【{self.ticket_id}】成功", self.emitter.uname, self.target.uname)
+        self.world.log(f"交易【{self.ticket_id}】成功", self.emitter.uname, self.target.uname)
         return False
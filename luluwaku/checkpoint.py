@@ -0,0 +1,100 @@
+from __future__ import annotations
+import os
+import traceback
+import typing
+from luluwaku.core import World
+from luluwaku import snapshot
+
+# Background checkpoints: after a judge, the process forks and the child
+# serializes the copy-on-write image of the world, fsyncs it to a temporary
+# file and exits, while the parent goes on judging. Finished children are
+# reaped on the next checkpoint (or `poll`/`wait`); the newest successful
+# one is renamed over `path`. Results go to `report`, an operator channel
+# kept apart from the world loggers that reach the players.
+
+
+class Checkpointer:
+    def __init__(
+        self,
+        world: World,
+        path: str,
+        max_children: int = 1,
+        every: int = 1,
+        report: typing.Callable[[str], typing.Any] | None = None,
+    ):
+        self.world = world
+        self.path = path
+        self.max_children = max_children
+        self.every = every
+        self.report = report
+        self.saved_tick = -1
+        self._children: dict[int, int] = {}
+
+    def attach(self):
+        self.world.judged += self.checkpoint
+
+    def detach(self):
+        self.world.judged -= self.checkpoint
+
+    def _report(self, msg: str):
+        if self.report is not None:
+            self.report(msg)
+
+    def _tmp(self, tick: int) -> str:
+        return f"{self.path}.{tick}.tmp"
+
+    def checkpoint(self) -> int | None:
+        self.poll()
+        tick = self.world.tick
+        if tick % self.every:
+            return None
+        if len(self._children) >= self.max_children:
+            self._report(f"checkpoint of tick {tick} skipped")
+            return None
+        if not hasattr(os, "fork"):
+            self._save(tick)
+            self._finish(tick, True)
+            return None
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._save(tick)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        self._children[pid] = tick
+        return pid
+
+    def _save(self, tick: int):
+        data = snapshot.dumps(self.world)
+        with open(self._tmp(tick), "wb") as f:
+            snapshot._write_record(f, snapshot.BASE, data, True)
+
+    def _finish(self, tick: int, ok: bool):
+        tmp = self._tmp(tick)
+        if not ok:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self._report(f"checkpoint of tick {tick} failed")
+        elif tick < self.saved_tick:
+            # a newer checkpoint finished first
+            os.remove(tmp)
+        else:
+            os.replace(tmp, self.path)
+            self.saved_tick = tick
+            self._report(f"checkpoint of tick {tick} saved to {self.path}")
+
+    def _reap(self, options: int):
+        for pid in list(self._children):
+            done, status = os.waitpid(pid, options)
+            if done:
+                self._finish(self._children.pop(pid), os.waitstatus_to_exitcode(status) == 0)
+
+    def poll(self):
+        self._reap(os.WNOHANG)
+
+    def wait(self):
+        self._reap(0)
@@ -1,12 +1,18 @@
 from __future__ import annotations
 from collections import deque
+import functools
+import heapq
+import itertools
 import math
+import operator
 import typing
+import weakref
 import typing_extensions
 import abc
 import array
 import random
 from dataclasses import dataclass
+from luluwaku.terrain import MapFile, TerrainLayer, write_map_file
 
 ## Functional lists
 
@@ -158,6 +164,9 @@ class Event:
 class Metadata:
     indices: dict[type, array.array[int]] = {}
     exact_indices: dict[type, int] = {}
+    types: tuple[type, ...] = ()
+    slots: dict[type, int] = {}
+    accessors: dict[type, typing.Callable[[Entity], typing.Any]] = {}
 
     def __init__(self, *types: type):
         exact_indices: dict[type, int] = {}
@@ -165,7 +174,24 @@ class Metadata:
         for t in types:
             self._aware_component(t, exact_indices, indices)
         self.exact_indices = exact_indices
-        self.indices = {k: array.array("i", list(indices[k])) for k in indices}
+        self.types = tuple(exact_indices)
+        self.indices = {k: array.array("i", sorted(indices[k])) for k in indices}
+        self.slots = {k: v[0] for k, v in self.indices.items() if len(v) == 1}
+        self.accessors = {k: self._make_accessor(k) for k in self.indices}
+
+    def __reduce__(self):
+        # re-adding the slot types in slot order reproduces the same layout
+        return (Metadata, self.types)
+
+    def _make_accessor(self, t: type) -> typing.Callable[[Entity], typing.Any]:
+        i = self.slots.get(t, -1)
+        if i == -1:
+            return lambda e: e.get_component(t)
+
+        def get(e: Entity):
+            return e._archetype.columns[i][e._row]
+
+        return get
 
     @staticmethod
     def _aware_component(
@@ -194,6 +220,62 @@ class Metadata:
                     parent.update(v)
 
 
+class Archetype:
+    metadata: Metadata
+    entities: list[Entity]
+    columns: list[list[Component | None]]
+
+    def __init__(self, metadata: Metadata):
+        self.metadata = metadata
+        self.entities = []
+        self.columns = [[] for _ in metadata.exact_indices]
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def add(self, e: Entity) -> int:
+        row = len(self.entities)
+        self.entities.append(e)
+        for column in self.columns:
+            column.append(None)
+        return row
+
+    def remove(self, e: Entity):
+        row = e._row
+        last = len(self.entities) - 1
+        moved = self.entities[last]
+        self.entities[row] = moved
+        self.entities.pop()
+        for column in self.columns:
+            column[row] = column[last]
+            column.pop()
+        moved._row = row
+
+    def resolve(self, types: tuple[type, ...]) -> tuple[array.array[int], ...] | None:
+        slots: list[array.array[int]] = []
+        for t in types:
+            indices = self.metadata.indices.get(t, None)
+            if indices is None:
+                return None
+            slots.append(indices)
+        return tuple(slots)
+
+    def column(self, indices: array.array[int]) -> list[Component | None]:
+        if len(indices) == 1:
+            return self.columns[indices[0]]
+        merged = list(self.columns[indices[0]])
+        for i in indices[1:]:
+            for row, o in enumerate(self.columns[i]):
+                if merged[row] is None:
+                    merged[row] = o
+        return merged
+
+    def select(self, slots: tuple[array.array[int], ...]) -> typing.Iterator[tuple]:
+        for row in zip(*[self.column(indices) for indices in slots]):
+            if None not in row:
+                yield row
+
+
 class Component:
     entity: Entity
 
@@ -201,9 +283,21 @@ class Component:
         self.entity = e
         self.entity.set_component(self)
 
+    def touch(self):
+        dirty = self.entity.world.dirty
+        if dirty is not None:
+            dirty.add(self)
+
     def init(self):
         pass
 
+    def despawned(self):
+        pass
+
+    @property
+    def world(self) -> World:
+        return self.entity.world
+
     def get_component(self, t: typing.Type[_C]) -> _C | None:
         return self.entity.get_component(t)
 
@@ -226,39 +320,66 @@ class Entity:
 
     __components__: tuple[typing.Type[Component], ...] = ()
     __metadata__: Metadata
+    _slots: dict[type, int]
 
     def __init_subclass__(cls) -> None:
         cls.__metadata__ = Metadata(*cls.__components__)
+        cls._slots = cls.__metadata__.slots
 
-    components: list[Component | None]
+    __transient__ = ("world", "eid", "_archetype", "_row")
+    _archetype: Archetype
+    _row: int
 
-    def __init__(self):
-        self.components = [None] * len(self.__metadata__.exact_indices)
+    world: World
+    eid: int
+
+    def __init__(self, world: World | None = None):
+        (world or GameState).spawn(self)
+
+    @property
+    def components(self) -> list[Component | None]:
+        row = self._row
+        return [column[row] for column in self._archetype.columns]
 
     def set_component(self, o: Component):
         t = type(o)
         i = self.__metadata__.exact_indices.get(t, -1)
         if i != -1:
-            self.components[i] = o
+            self._archetype.columns[i][self._row] = o
+            o.touch()
             return True
         return False
 
     def get_component(self, t: typing.Type[_C]) -> _C | None:
+        i = self._slots.get(t, -1)
+        if i != -1:
+            return self._archetype.columns[i][self._row]  # type: ignore
         indices = self.__metadata__.indices.get(t, None)
         if indices is not None:
+            columns = self._archetype.columns
+            row = self._row
             for i in indices:
-                o = self.components[i]
-                if isinstance(o, t):
-                    return o
+                o = columns[i][row]
+                if o is not None:
+                    return o  # type: ignore
         return None
 
     def __getitem__(self, t: typing.Type[_C]) -> _C:
-        o = self.get_component(t)
+        i = self._slots.get(t, -1)
+        if i != -1:
+            o = self._archetype.columns[i][self._row]
+        else:
+            o = self.get_component(t)
         if o is not None:
-            return o
+            return o  # type: ignore
         index = self.__metadata__.exact_indices.get(t, -1)
         if index == -1:
             raise NoComponentError(t)
+        # create the declared type, which may be a subclass of `t`
+        for declared in self.__components__:
+            if issubclass(declared, t):
+                t = declared
+                break
         result: _C = t()
         result.ready(self)
         result.init()
@@ -266,33 +387,626 @@ class Entity:
         return result
 
 
+## Shapes
+
+# An area shape is a stencil of cell offsets around an origin, stored as one
+# or more runs (dy, dx0, dx1) per row so it can be clipped against the map
+# row by row. Stencils are built once per (shape, size, orientation);
+# orientations are quantized to DIRECTIONS steps.
+
+DIRECTIONS = 32
+
+
+@dataclass(frozen=True)
+class Stencil:
+    runs: tuple[tuple[int, int, int], ...]
+    radius: int
+
+    @functools.cached_property
+    def rows(self) -> dict[int, tuple[tuple[int, int], ...]]:
+        rows: dict[int, list[tuple[int, int]]] = {}
+        for dy, dx0, dx1 in self.runs:
+            rows.setdefault(dy, []).append((dx0, dx1))
+        return {dy: tuple(spans) for dy, spans in rows.items()}
+
+    def __len__(self) -> int:
+        return sum(dx1 - dx0 + 1 for _, dx0, dx1 in self.runs)
+
+    def __contains__(self, offset: tuple[int, int]) -> bool:
+        dx, dy = offset
+        for dx0, dx1 in self.rows.get(dy, ()):
+            if dx0 <= dx <= dx1:
+                return True
+        return False
+
+
+def _stencil(radius: int, inside: typing.Callable[[int, int], bool]) -> Stencil:
+    runs = []
+    for dy in range(-radius, radius + 1):
+        start = None
+        for dx in range(-radius, radius + 2):
+            if dx <= radius and inside(dx, dy):
+                if start is None:
+                    start = dx
+            elif start is not None:
+                runs.append((dy, start, dx - 1))
+                start = None
+    return Stencil(tuple(runs), radius)
+
+
+def quantize_direction(dx: float, dy: float) -> int:
+    return round(math.atan2(dy, dx) / (2 * math.pi) * DIRECTIONS) % DIRECTIONS
+
+
+@functools.lru_cache(maxsize=None)
+def circle(radius: float) -> Stencil:
+    r2 = radius * radius
+    return _stencil(math.floor(radius), lambda dx, dy: dx * dx + dy * dy <= r2)
+
+
+@functools.lru_cache(maxsize=None)
+def ring(inner: float, outer: float) -> Stencil:
+    i2 = inner * inner
+    o2 = outer * outer
+    return _stencil(math.floor(outer), lambda dx, dy: i2 < dx * dx + dy * dy <= o2)
+
+
+@functools.lru_cache(maxsize=None)
+def cone(radius: float, direction: int, spread: int) -> Stencil:
+    # `direction` and the full angle `spread` are in DIRECTIONS steps
+    r2 = radius * radius
+    angle = direction * 2 * math.pi / DIRECTIONS
+    ux, uy = math.cos(angle), math.sin(angle)
+    cos_half = math.cos(min(spread, DIRECTIONS) * math.pi / DIRECTIONS)
+
+    def inside(dx: int, dy: int) -> bool:
+        d2 = dx * dx + dy * dy
+        if d2 > r2:
+            return False
+        return d2 == 0 or dx * ux + dy * uy >= cos_half * math.sqrt(d2) - 1e-9
+
+    return _stencil(math.floor(radius), inside)
+
+
+@functools.lru_cache(maxsize=None)
+def rect(length: float, half_width: float, direction: int) -> Stencil:
+    # from the origin along `direction`, `half_width` to each side
+    angle = direction * 2 * math.pi / DIRECTIONS
+    ux, uy = math.cos(angle), math.sin(angle)
+
+    def inside(dx: int, dy: int) -> bool:
+        along = dx * ux + dy * uy
+        return -1e-9 <= along <= length + 1e-9 and abs(dy * ux - dx * uy) <= half_width + 1e-9
+
+    return _stencil(math.ceil(math.hypot(length, half_width)), inside)
+
+
 ## Map
 
 
+# occupied cells are indexed by buckets of BUCKET x BUCKET cells, so unit
+# queries visit the buckets around a point instead of every cell of an area
+Bucket = typing.Dict["Unit", "MapCell"]
+
+
+PASS_COST = "pass_cost"
+ELEVATION = "elevation"
+FLAGS = "flags"
+
+# bits of the FLAGS layer
+OPAQUE = 1
+
+
+# Cells live in CHUNK x CHUNK chunks of a sparse store; terrain is kept in
+# typed layers (see luluwaku.terrain). A cell without units or listeners is
+# only a view: the map hands it out and keeps it weakly, and stores it once
+# it gains state (`MapCell.touch`). Stored cells that went back to the
+# default can be dropped by `evict_idle`.
 class Map(Component):
-    _cells: list[MapCell | None]
+    __transient__ = (
+        "_chunks",
+        "_views",
+        "_buckets",
+        "_sights",
+        "_sight_counts",
+        "_flow_fields",
+        "_region_index",
+        "_range_table",
+    )
+    BUCKET = 8
+    REGION_BUCKET = 16
+    # units a cell can hold after a movement round, see World._resolve_moves
+    CELL_CAPACITY = 1
+    CHUNK = 32
+    FLOW_FIELDS = 16
+    _chunks: dict[int, dict[int, MapCell]]
+    _views: weakref.WeakValueDictionary[int, MapCell]
+    _buckets: dict[tuple[int, int], Bucket] | None = None
+    # sight distance of every unit on the map and the number of units per
+    # distance, built with the spatial index on first use
+    _sights: dict[Unit, float] | None = None
+    _sight_counts: dict[float, int]
+    _flow_fields: dict[tuple[int, int], FlowField]
+    layers: dict[str, TerrainLayer]
+    regions: list[Region]
+    _region_index: dict[tuple[int, int], list[Region]] | None = None
+    _range_table: RangeTable | None = None
     row: int
     col: int
     name: str
 
     def __init__(self, row: int, col: int, name: str, entity: Entity):
         self.ready(entity)
-        self._cells = [None] * (row * col)
         self.row = row
         self.col = col
         self.name = name
+        self.regions = []
+        self.layers = {}
+        self.add_layer(PASS_COST, "i", 1)
+        self.add_layer(ELEVATION, "f", 0.0)
+        self.add_layer(FLAGS, "B", 0)
+        self._reset_transient()
+        self._buckets = {}
+
+    def add_layer(self, name: str, typecode: str, default: int | float) -> TerrainLayer:
+        layer = self.layers[name] = TerrainLayer(
+            self, self.row, self.col, typecode, default, self.CHUNK
+        )
+        self.touch()
+        return layer
+
+    ## Regions
+
+    def add_region(self, region: Region) -> Region:
+        self.regions.append(region)
+        region.map = self
+        self._index_region(region)
+        self.touch()
+        return region
+
+    def remove_region(self, region: Region):
+        self.regions.remove(region)
+        region.map = None
+        self._region_index = None
+        self.touch()
+
+    def _index_region(self, region: Region):
+        index = self._region_index
+        if index is None:
+            return
+        B = self.REGION_BUCKET
+        x0, y0, x1, y1 = region.bounds()
+        for i in range(max(y0, 0) // B, min(y1, self.row - 1) // B + 1):
+            for j in range(max(x0, 0) // B, min(x1, self.col - 1) // B + 1):
+                index.setdefault((i, j), []).append(region)
+
+    def regions_at(self, x: int, y: int) -> list[Region]:
+        if not self.regions:
+            return []
+        index = self._region_index
+        if index is None:
+            index = self._region_index = {}
+            for region in self.regions:
+                self._index_region(region)
+        B = self.REGION_BUCKET
+        return [r for r in index.get((y // B, x // B), ()) if r.contains(x, y)]
+
+    def range_table(self) -> RangeTable:
+        # shared by every range check until a unit moves or the tick ends
+        table = self._range_table
+        tick = self.entity.world.tick
+        if table is None or table.tick != tick:
+            table = self._range_table = RangeTable(self, tick)
+        return table
+
+    ## Sight
+
+    def field_of_view(self, x: int, y: int, radius: float) -> frozenset[tuple[int, int]]:
+        # recursive shadowcasting: OPAQUE cells are seen but hide what is
+        # behind them
+        if self.find_cell_at_point(x, y) is None:
+            return frozenset()
+        visible = {(x, y)}
+        flags = self.layers[FLAGS]
+        r = int(radius)
+        for xx, xy, yx, yy in _OCTANTS:
+            _cast_light(self, flags, visible, x, y, 1, 1.0, 0.0, r, radius * radius, xx, xy, yx, yy)
+        return frozenset(visible)
+
+    def units_seeing(self, x: int, y: int) -> list[Unit]:
+        # units whose field of view holds (x, y), looked up among the units
+        # within the longest sight distance on the map around it
+        seeing = []
+        for unit in self.units_in_radius(x, y, self.max_sight()):
+            pos = unit.get_component(Positional)
+            if pos is not None and (x, y) in pos.visible_cells():
+                seeing.append(unit)
+        return seeing
+
+    @classmethod
+    def open(cls, path: str, name: str, entity: Entity) -> Map:
+        # terrain chunks are faulted in from the map file when first used
+        f = MapFile.open(path)
+        m = cls(f.row, f.col, name, entity)
+        if f.chunk != m.CHUNK:
+            raise ValueError(f"{path} has chunks of {f.chunk}, expected {m.CHUNK}")
+        for index, (layer_name, typecode, default, _) in enumerate(f.layers):
+            layer = m.add_layer(
+                layer_name, typecode, default if typecode in "fd" else int(default)
+            )
+            layer.path = path
+            layer.index = index
+        return m
+
+    def save(self, path: str):
+        write_map_file(path, self.row, self.col, self.CHUNK, self.layers)
+
+    def release_chunks(self, close: bool = False) -> int:
+        # drop idle cells, then the unmodified terrain chunks without cells;
+        # `close` also unmaps the map file until a chunk is faulted again
+        self.evict_idle()
+        released = sum(layer.release(self._chunks) for layer in self.layers.values())
+        if close:
+            for layer in self.layers.values():
+                layer.close()
+        return released
+
+    @property
+    def terrain_version(self) -> int:
+        return self.layers[PASS_COST].version
+
+    def _chunk_of(self, i: int, j: int) -> int:
+        C = self.CHUNK
+        return (i // C) * (self.col // C + 1) + j // C
 
     def __getitem__(self, ij: tuple[int, int]):
         i, j = ij
-
-        index = i * self.row + j
-        if index < 0 or index > len(self._cells):
+        if not (0 <= i < self.row and 0 <= j < self.col):
             return None
-        cell = self._cells[index]
+        key = i * self.col + j
+        chunk = self._chunks.get(self._chunk_of(i, j), None)
+        if chunk is not None:
+            cell = chunk.get(key, None)
+            if cell is not None:
+                return cell
+        cell = self._views.get(key, None)
         if cell is None:
-            cell = self._cells[index] = MapCell(i, j, self)
+            cell = self._views[key] = MapCell(i, j, self)
         return cell
 
+    def _reset_transient(self):
+        self._chunks = {}
+        self._views = weakref.WeakValueDictionary()
+        self._buckets = None
+        self._sights = None
+        self._flow_fields = {}
+        self._region_index = None
+        self._range_table = None
+
+    def __getstate__(self):
+        return {**self.__dict__, "_views": None, "_flow_fields": {}}
+
+    def __setstate__(self, state: dict[str, typing.Any]):
+        self.__dict__.update(state)
+        self._views = weakref.WeakValueDictionary()
+
+    def cells(self) -> typing.Iterator[MapCell]:
+        for chunk in list(self._chunks.values()):
+            yield from list(chunk.values())
+
+    def _peek(self, i: int, j: int) -> MapCell | None:
+        key = i * self.col + j
+        chunk = self._chunks.get(self._chunk_of(i, j), None)
+        cell = chunk and chunk.get(key, None)
+        return cell or self._views.get(key, None)
+
+    def _store(self, cell: MapCell):
+        i, j = cell.y, cell.x
+        cid = self._chunk_of(i, j)
+        chunk = self._chunks.get(cid, None)
+        if chunk is None:
+            chunk = self._chunks[cid] = {}
+        key = i * self.col + j
+        chunk[key] = cell
+        self._views.pop(key, None)
+
+    def _stored(self, cell: MapCell) -> bool:
+        chunk = self._chunks.get(self._chunk_of(cell.y, cell.x), None)
+        return chunk is not None and chunk.get(cell.y * self.col + cell.x, None) is cell
+
+    def _adopt(self, cell: MapCell):
+        self._store(cell)
+        self._buckets = None
+        self._sights = None
+
+    def evict_idle(self) -> int:
+        # back to views: stored cells that are in the default state again
+        evicted = 0
+        for cid, chunk in list(self._chunks.items()):
+            for key, cell in list(chunk.items()):
+                if cell.is_idle():
+                    del chunk[key]
+                    self._views[key] = cell
+                    evicted += 1
+            if not chunk:
+                del self._chunks[cid]
+        return evicted
+
+    ## Spatial index
+
+    def _index(self) -> dict[tuple[int, int], Bucket]:
+        buckets = self._buckets
+        if buckets is None:
+            buckets = self._buckets = {}
+            for cell in self.cells():
+                for unit in cell.contained_units:
+                    self._enter(unit, cell)
+        return buckets
+
+    def _enter(self, unit: Unit, cell: MapCell):
+        buckets = self._buckets
+        if buckets is None:
+            return
+        if self._sights is not None:
+            self._see(unit)
+        key = (cell.y // self.BUCKET, cell.x // self.BUCKET)
+        bucket = buckets.get(key, None)
+        if bucket is None:
+            bucket = buckets[key] = {}
+        bucket[unit] = cell
+
+    def _leave(self, unit: Unit, cell: MapCell):
+        buckets = self._buckets
+        if buckets is None:
+            return
+        key = (cell.y // self.BUCKET, cell.x // self.BUCKET)
+        bucket = buckets.get(key, None)
+        if bucket is not None and bucket.get(unit, None) is cell:
+            del bucket[unit]
+            if not bucket:
+                del buckets[key]
+            if self._sights is not None:
+                self._unsee(unit)
+
+    def max_sight(self) -> float:
+        # the longest sight distance of the units on the map
+        if self._sights is None:
+            index = self._index()
+            self._sights = {}
+            self._sight_counts = {}
+            for bucket in index.values():
+                for unit in bucket:
+                    self._see(unit)
+        return max(self._sight_counts, default=0.0)
+
+    def _see(self, unit: Unit):
+        assert self._sights is not None
+        board = unit.get_component(Board)
+        sight = self._sights[unit] = board.SIGHT_DIST if board else Board.SIGHT_DIST
+        self._sight_counts[sight] = self._sight_counts.get(sight, 0) + 1
+
+    def _unsee(self, unit: Unit):
+        assert self._sights is not None
+        sight = self._sights.pop(unit, None)
+        if sight is None:
+            return
+        n = self._sight_counts[sight] - 1
+        if n:
+            self._sight_counts[sight] = n
+        else:
+            del self._sight_counts[sight]
+
+    def _sight_changed(self, unit: Unit):
+        if self._sights is not None and unit in self._sights:
+            self._unsee(unit)
+            self._see(unit)
+
+    def _buckets_in_rect(
+        self, x0: int, y0: int, x1: int, y1: int
+    ) -> typing.Iterator[Bucket]:
+        index = self._index()
+        B = self.BUCKET
+        i0, i1 = max(y0, 0) // B, min(y1, self.row - 1) // B
+        j0, j1 = max(x0, 0) // B, min(x1, self.col - 1) // B
+        if i0 > i1 or j0 > j1:
+            return
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(index):
+            for (i, j), bucket in list(index.items()):
+                if i0 <= i <= i1 and j0 <= j <= j1:
+                    yield bucket
+            return
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                bucket = index.get((i, j), None)
+                if bucket is not None:
+                    yield bucket
+
+    def units_in_rect(self, x0: int, y0: int, x1: int, y1: int) -> list[Unit]:
+        # bounds are inclusive
+        units = []
+        for bucket in self._buckets_in_rect(x0, y0, x1, y1):
+            for unit, cell in bucket.items():
+                if x0 <= cell.x <= x1 and y0 <= cell.y <= y1:
+                    units.append(unit)
+        return units
+
+    def units_in_radius(self, x: int, y: int, radius: float) -> list[Unit]:
+        r = int(radius)
+        r2 = radius * radius
+        units = []
+        for bucket in self._buckets_in_rect(x - r, y - r, x + r, y + r):
+            for unit, cell in bucket.items():
+                if (cell.x - x) ** 2 + (cell.y - y) ** 2 <= r2:
+                    units.append(unit)
+        return units
+
+    def nearest_units(
+        self, x: int, y: int, k: int, radius: float = math.inf
+    ) -> list[Unit]:
+        index = self._index()
+        if k <= 0 or not index:
+            return []
+        B = self.BUCKET
+        bi, bj = y // B, x // B
+        r2 = radius * radius
+        # a max-heap of the k nearest units found so far
+        heap: list[tuple[int, int, Unit]] = []
+        counter = itertools.count()
+
+        def scan(bucket: Bucket):
+            for unit, cell in bucket.items():
+                d2 = (cell.x - x) ** 2 + (cell.y - y) ** 2
+                if d2 > r2:
+                    continue
+                item = (-d2, -next(counter), unit)
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        last_ring = max(self.row, self.col) // B + 1
+        for ring in range(last_ring + 1):
+            # no cell of this ring is nearer than `bound`
+            bound = max(0, (ring - 1) * B + 1)
+            if bound > radius or (len(heap) == k and -heap[0][0] <= bound * bound):
+                break
+            if 8 * ring > len(index):
+                # sparse map: scan the remaining buckets directly
+                for (i, j), bucket in index.items():
+                    if max(abs(i - bi), abs(j - bj)) >= ring:
+                        scan(bucket)
+                break
+            for i in range(bi - ring, bi + ring + 1):
+                step = 1 if i in (bi - ring, bi + ring) else 2 * ring or 1
+                for j in range(bj - ring, bj + ring + 1, step):
+                    bucket = index.get((i, j), None)
+                    if bucket is not None:
+                        scan(bucket)
+        heap.sort(reverse=True)
+        return [unit for _, _, unit in heap]
+
+    ## Beams
+
+    def cells_on_beam(
+        self, x: int, y: int, dx: float, dy: float, length: float, radius: float
+    ) -> list[tuple[int, int]]:
+        # cells within `radius` of the segment from (x, y) along (dx, dy),
+        # each once: a scan along the major axis of the beam that only
+        # visits the strip around the line
+        norm = math.hypot(dx, dy)
+        if norm == 0:
+            length = 0.0
+            dx, norm = 1.0, 1.0
+        ux, uy = dx / norm, dy / norm
+        steep = abs(uy) > abs(ux)
+        if steep:
+            a0, b0, ua, ub, a_end, b_end = y, x, uy, ux, self.row, self.col
+        else:
+            a0, b0, ua, ub, a_end, b_end = x, y, ux, uy, self.col, self.row
+        ea = a0 + ua * length
+        slope = ub / ua
+        half = radius / abs(ua)
+        r2 = radius * radius
+        cells = []
+        lo = max(math.floor(min(a0, ea) - radius), 0)
+        hi = min(math.ceil(max(a0, ea) + radius), a_end - 1)
+        for a in range(lo, hi + 1):
+            center = b0 + (a - a0) * slope
+            pa = a - a0
+            for b in range(
+                max(math.ceil(center - half), 0),
+                min(math.floor(center + half), b_end - 1) + 1,
+            ):
+                pb = b - b0
+                t = pa * ua + pb * ub
+                t = 0.0 if t < 0 else length if t > length else t
+                da = pa - ua * t
+                db = pb - ub * t
+                if da * da + db * db <= r2:
+                    cells.append((b, a) if steep else (a, b))
+        return cells
+
+    def units_on_beam(
+        self, x: int, y: int, dx: float, dy: float, length: float, radius: float
+    ) -> list[Unit]:
+        # nearest to (x, y) first
+        found: list[tuple[int, int, Unit]] = []
+        for cx, cy in self.cells_on_beam(x, y, dx, dy, length, radius):
+            cell = self._peek(cy, cx)
+            if cell is not None:
+                d2 = (cx - x) ** 2 + (cy - y) ** 2
+                for unit in cell.contained_units:
+                    found.append((d2, len(found), unit))
+        found.sort()
+        return [unit for _, _, unit in found]
+
+    ## Paths
+
+    def pass_cost(self, x: int, y: int) -> int:
+        # the cost of entering (x, y), without materializing the cell
+        return self.layers[PASS_COST].get(x, y)
+
+    def neighbours(self, x: int, y: int) -> typing.Iterator[tuple[int, int]]:
+        for dy in (-1, 0, 1):
+            ny = y + dy
+            if not 0 <= ny < self.row:
+                continue
+            for dx in (-1, 0, 1):
+                nx = x + dx
+                if (dx or dy) and 0 <= nx < self.col:
+                    yield nx, ny
+
+    def find_path(
+        self,
+        start: tuple[int, int],
+        goal: tuple[int, int],
+        budget: float = math.inf,
+    ) -> list[tuple[int, int]] | None:
+        # A* over the 8 neighbours of a cell; returns the cells to enter
+        # (without `start`), or None when the goal costs more than `budget`
+        if start == goal:
+            return []
+        gx, gy = goal
+        if self.find_cell_at_point(gx, gy) is None:
+            return None
+        min_cost = 1
+        costs = {start: 0}
+        came_from: dict[tuple[int, int], tuple[int, int]] = {}
+        counter = itertools.count()
+        frontier = [(0, 0, next(counter), start)]
+        while frontier:
+            _, g, _, node = heapq.heappop(frontier)
+            if node == goal:
+                path = [node]
+                while path[-1] in came_from:
+                    path.append(came_from[path[-1]])
+                path.pop()
+                path.reverse()
+                return path
+            if g > costs[node]:
+                continue
+            for nxt in self.neighbours(*node):
+                ng = g + self.pass_cost(*nxt)
+                if ng > budget or ng >= costs.get(nxt, math.inf):
+                    continue
+                costs[nxt] = ng
+                came_from[nxt] = node
+                h = max(abs(nxt[0] - gx), abs(nxt[1] - gy)) * min_cost
+                heapq.heappush(frontier, (ng + h, ng, next(counter), nxt))
+        return None
+
+    def flow_field(self, goal: tuple[int, int]) -> FlowField:
+        # a goal off the map is moved to the nearest cell on its edge
+        goal = (clamp(goal[0], 0, self.col - 1), clamp(goal[1], 0, self.row - 1))
+        fields = self._flow_fields
+        field = fields.pop(goal, None)
+        if field is None or field.version != self.terrain_version:
+            field = FlowField(self, goal)
+            if len(fields) >= self.FLOW_FIELDS:
+                del fields[next(iter(fields))]
+        fields[goal] = field
+        return field
+
     def find_cell_at_point(self, x: int, y: int) -> MapCell | None:
         i = y
         j = x
@@ -301,17 +1015,141 @@ class Map(Component):
         return None
 
     def find_cells_within_circle(self, x: int, y: int, radius: float):
-        i = y
-        j = x
-        r = math.ceil(radius)
-        for k in range(i - r, i + r + 1):
-            for l in range(j - r, j + r + 1):
-                if k < 0 or k >= self.row or l < 0 or l >= self.col:
-                    continue
-                if (k - i) ** 2 + (l - j) ** 2 <= r * r:
-                    cell = self[k, l]
-                    assert cell
-                    yield cell
+        return self.cells_in_shape(x, y, circle(math.ceil(radius)))
+
+    ## Shapes
+
+    def coords_in_shape(self, x: int, y: int, stencil: Stencil) -> list[tuple[int, int]]:
+        coords = []
+        col = self.col
+        for dy, dx0, dx1 in stencil.runs:
+            cy = y + dy
+            if 0 <= cy < self.row:
+                x0 = x + dx0 if x + dx0 > 0 else 0
+                x1 = x + dx1 if x + dx1 < col else col - 1
+                coords.extend((cx, cy) for cx in range(x0, x1 + 1))
+        return coords
+
+    def cells_in_shape(self, x: int, y: int, stencil: Stencil) -> typing.Iterator[MapCell]:
+        for cx, cy in self.coords_in_shape(x, y, stencil):
+            yield self[cy, cx]
+
+    def units_in_shape(self, x: int, y: int, stencil: Stencil) -> list[Unit]:
+        r = stencil.radius
+        units = []
+        for bucket in self._buckets_in_rect(x - r, y - r, x + r, y + r):
+            for unit, cell in bucket.items():
+                if (cell.x - x, cell.y - y) in stencil:
+                    units.append(unit)
+        return units
+
+
+# Costs of reaching one goal from every cell, shared by all units heading
+# there. The reverse Dijkstra search is resumed only as far as the cells
+# asked for; the map drops the field once its terrain changes.
+class FlowField:
+    def __init__(self, map: Map, goal: tuple[int, int]):
+        self.map = map
+        self.goal = goal
+        self.version = map.terrain_version
+        self.costs: dict[tuple[int, int], int] = {goal: 0}
+        self.settled: set[tuple[int, int]] = set()
+        self._frontier = [(0, goal)]
+
+    def cost(self, x: int, y: int) -> float:
+        node = (x, y)
+        if self.map.find_cell_at_point(x, y) is None:
+            return math.inf
+        m = self.map
+        costs = self.costs
+        settled = self.settled
+        frontier = self._frontier
+        while node not in settled and frontier:
+            c, cur = heapq.heappop(frontier)
+            if cur in settled:
+                continue
+            settled.add(cur)
+            # every neighbour pays the cost of entering `cur`
+            step = c + m.pass_cost(*cur)
+            for nxt in m.neighbours(*cur):
+                if step < costs.get(nxt, math.inf):
+                    costs[nxt] = step
+                    heapq.heappush(frontier, (step, nxt))
+        return costs.get(node, math.inf)
+
+    def next_step(self, x: int, y: int) -> tuple[int, int] | None:
+        if (x, y) == self.goal or self.cost(x, y) == math.inf:
+            return None
+        best = None
+        best_cost = math.inf
+        for nxt in self.map.neighbours(x, y):
+            c = self.cost(*nxt) + self.map.pass_cost(*nxt)
+            if c < best_cost:
+                best, best_cost = nxt, c
+        return best
+
+
+_OCTANTS = (
+    (1, 0, 0, 1),
+    (0, 1, 1, 0),
+    (0, -1, 1, 0),
+    (-1, 0, 0, 1),
+    (-1, 0, 0, -1),
+    (0, -1, -1, 0),
+    (0, 1, -1, 0),
+    (1, 0, 0, -1),
+)
+
+
+def _cast_light(
+    m: Map,
+    flags: TerrainLayer,
+    visible: set[tuple[int, int]],
+    cx: int,
+    cy: int,
+    row: int,
+    start: float,
+    end: float,
+    r: int,
+    r2: float,
+    xx: int,
+    xy: int,
+    yx: int,
+    yy: int,
+):
+    if start < end:
+        return
+    new_start = 0.0
+    for j in range(row, r + 1):
+        dx = -j - 1
+        dy = -j
+        blocked = False
+        while dx <= 0:
+            dx += 1
+            X = cx + dx * xx + dy * xy
+            Y = cy + dx * yx + dy * yy
+            l_slope = (dx - 0.5) / (dy + 0.5)
+            r_slope = (dx + 0.5) / (dy - 0.5)
+            if start < r_slope:
+                continue
+            if end > l_slope:
+                break
+            inside = 0 <= X < m.col and 0 <= Y < m.row
+            if inside and dx * dx + dy * dy <= r2:
+                visible.add((X, Y))
+            opaque = not inside or flags.get(X, Y) & OPAQUE
+            if blocked:
+                if opaque:
+                    new_start = r_slope
+                else:
+                    blocked = False
+                    start = new_start
+            elif opaque and j < r:
+                blocked = True
+                _cast_light(m, flags, visible, cx, cy, j + 1, start, l_slope, r, r2, xx, xy, yx, yy)
+                new_start = r_slope
+        if blocked:
+            break
 
 
 class MapListener(typing_extensions.Protocol):
@@ -319,31 +1157,171 @@ class MapListener(typing_extensions.Protocol):
         ...
 
 
+## Regions
+
+
+# An area with enter and exit listeners. Maps index regions by buckets of
+# their bounds, and a move only fires the regions that differ between the
+# old and the new cell.
+class Region(abc.ABC):
+    enter_listeners: PList[MapListener] = PList.empty_cov()
+    exit_listeners: PList[MapListener] = PList.empty_cov()
+    # the map the region was added to, saved with it
+    map: Map | None = None
+
+    @abc.abstractmethod
+    def bounds(self) -> tuple[int, int, int, int]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def contains(self, x: int, y: int) -> bool:
+        raise NotImplementedError
+
+    def touch(self):
+        if self.map is not None:
+            self.map.touch()
+
+    def register_enter_events(self, listener: MapListener):
+        self.enter_listeners = PList.cons(listener, self.enter_listeners)
+        self.touch()
+
+    def register_leave_events(self, listener: MapListener):
+        self.exit_listeners = PList.cons(listener, self.exit_listeners)
+        self.touch()
+
+    def entered_by(self, unit: Unit, cell: MapCell):
+        for each in self.enter_listeners:
+            each(unit, cell)
+
+    def left_by(self, unit: Unit, cell: MapCell):
+        for each in self.exit_listeners:
+            each(unit, cell)
+
+
+def _cross_regions(
+    unit: Unit,
+    old: list[Region],
+    new: list[Region],
+    old_cell: MapCell | None,
+    new_cell: MapCell | None,
+):
+    for region in old:
+        if region not in new:
+            region.left_by(unit, typing.cast(MapCell, old_cell))
+    for region in new:
+        if region not in old:
+            region.entered_by(unit, typing.cast(MapCell, new_cell))
+
+
+class RectRegion(Region):
+    def __init__(self, x0: int, y0: int, x1: int, y1: int):
+        # bounds are inclusive
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+
+    def bounds(self):
+        return self.x0, self.y0, self.x1, self.y1
+
+    def contains(self, x: int, y: int) -> bool:
+        return self.x0 <= x <= self.x1 and self.y0 <= y <= self.y1
+
+
+class CircleRegion(Region):
+    def __init__(self, x: int, y: int, radius: float):
+        self.x, self.y, self.radius = x, y, radius
+
+    def bounds(self):
+        r = int(self.radius)
+        return self.x - r, self.y - r, self.x + r, self.y + r
+
+    def contains(self, x: int, y: int) -> bool:
+        return (x - self.x) ** 2 + (y - self.y) ** 2 <= self.radius**2
+
+
+class PolygonRegion(Region):
+    def __init__(self, points: typing.Sequence[tuple[float, float]]):
+        self.points = tuple(points)
+
+    def bounds(self):
+        xs = [x for x, _ in self.points]
+        ys = [y for _, y in self.points]
+        return (
+            math.floor(min(xs)),
+            math.floor(min(ys)),
+            math.ceil(max(xs)),
+            math.ceil(max(ys)),
+        )
+
+    def contains(self, x: int, y: int) -> bool:
+        # even-odd rule on the cell centre
+        inside = False
+        points = self.points
+        px, py = points[-1]
+        for qx, qy in points:
+            if (qy > y) != (py > y) and x < (px - qx) * (y - qy) / (py - qy) + qx:
+                inside = not inside
+            px, py = qx, qy
+        return inside
+
+
+_NO_UNITS: set[Unit] = typing.cast("set[Unit]", frozenset())
+
+
 class MapCell:
+    contained_units: set[Unit] = _NO_UNITS
+    enter_listeners: PList[MapListener] = PList.empty_cov()
+    exit_listeners: PList[MapListener] = PList.empty_cov()
+
     def __init__(self, Y: int, X: int, map: Map):
         self.x = X
         self.y = Y
         self.map = map
-        self.pass_consumption: int = 1
-        self.contained_units: set[Unit] = set()
-        self.enter_listeners: PList[MapListener] = PList.empty_cov()
-        self.exit_listeners: PList[MapListener] = PList.empty_cov()
+
+    @property
+    def pass_consumption(self) -> int:
+        return self.map.layers[PASS_COST].get(self.x, self.y)
+
+    @pass_consumption.setter
+    def pass_consumption(self, value: int):
+        self.map.layers[PASS_COST].set(self.x, self.y, value)
+
+    def is_idle(self) -> bool:
+        return (
+            not self.contained_units
+            and self.enter_listeners.is_empty
+            and self.exit_listeners.is_empty
+        )
+
+    def touch(self):
+        m = self.map
+        if not m._stored(self):
+            m._store(self)
+        dirty = m.entity.world.dirty
+        if dirty is not None:
+            dirty.add(self)
 
     def register_leave_events(self, listener: MapListener):
         self.exit_listeners = PList.cons(listener, self.exit_listeners)
+        self.touch()
 
     def register_enter_events(self, listener: MapListener):
         self.enter_listeners = PList.cons(listener, self.enter_listeners)
+        self.touch()
 
     def unsafe_left_by(self, unit: Unit, cell: MapCell):
         if unit in self.contained_units:
             self.contained_units.remove(unit)
+            self.map._leave(unit, self)
+            self.touch()
             for each in self.exit_listeners:
                 each(unit, cell)
 
     def unsafe_entered_by(self, unit: Unit, cell: MapCell):
         if unit not in self.contained_units:
+            if self.contained_units is _NO_UNITS:
+                self.contained_units = set()
             self.contained_units.add(unit)
+            self.map._enter(unit, self)
+            self.touch()
             for each in self.enter_listeners:
                 each(unit, cell)
 
@@ -355,8 +1333,11 @@ class MapCell:
 
 
 class Positional(Component):
+    __transient__ = ("_fov",)
     _X = -1
     _Y = -1
+    # (key, cells) of the last field of view, see `visible_cells`
+    _fov: tuple[tuple, frozenset[tuple[int, int]]] | None = None
 
     def __init__(self, map: Map, unit: Unit):
         self.ready(unit.entity)
@@ -364,21 +1345,140 @@ class Positional(Component):
         self.unit = unit
 
     def loc(self):
-        return self.map[self._X, self._Y]
+        return self.map.find_cell_at_point(self._X, self._Y)
+
+    def despawned(self):
+        # the unit leaves its cell, the spatial index and its regions
+        area = self.loc()
+        if area is not None:
+            self._place(-1, -1, self.map, area, self.map.regions_at(area.x, area.y))
 
     def set_pos(self, x: int, y: int, map: Map | None = None):
-        self.map = new_map = map or self.map
         old_area = self.map.find_cell_at_point(self._X, self._Y)
+        old_regions = old_area.map.regions_at(old_area.x, old_area.y) if old_area else []
+        return self._place(x, y, map or self.map, old_area, old_regions)
+
+    def _place(
+        self,
+        x: int,
+        y: int,
+        new_map: Map,
+        old_area: MapCell | None,
+        old_regions: list[Region],
+        cross_regions: bool = True,
+    ):
+        # moves the unit and fires the events of the cells left and entered,
+        # and those of the regions too unless `cross_regions` is False
+        self.map._range_table = None
+        self.map = new_map
+        new_map._range_table = None
         new_area = new_map.find_cell_at_point(x, y)
         self._X = x
         self._Y = y
+        self.touch()
         if old_area is not new_area:
             if old_area:
                 old_area.unsafe_left_by(self.unit, old_area)
             if new_area:
                 new_area.unsafe_entered_by(self.unit, new_area)
+        if not cross_regions:
+            return new_area
+        new_regions = new_map.regions_at(x, y) if new_area else []
+        if old_regions or new_regions:
+            _cross_regions(self.unit, old_regions, new_regions, old_area, new_area)
         return new_area
 
+    def affordable_steps(self, path: typing.Sequence[tuple[int, int]], board: Board) -> int:
+        # the rule of consume_efforts, applied step by step
+        if not board.alive:
+            return 0
+        m = self.map
+        left = board.EFFORTS
+        steps = 0
+        for x, y in path:
+            cost = m.pass_cost(x, y)
+            if left <= cost:
+                break
+            left -= cost
+            steps += 1
+        return steps
+
+    def commit_path(
+        self, path: typing.Sequence[tuple[int, int]], board: Board | None = None
+    ) -> int:
+        # Walks `path` (the cells to enter, in order) as a single move. The
+        # efforts of all affordable steps are charged at once and the unit
+        # only leaves its cell and enters the last one; the cells and regions
+        # crossed on the way get their events in order, after the unit is
+        # placed at the end of the path. Returns the number of steps taken.
+        m = self.map
+        steps = len(path)
+        if board is not None:
+            steps = self.affordable_steps(path, board)
+            total = sum(m.pass_cost(x, y) for x, y in path[:steps])
+            if total:
+                board.EFFORTS -= total
+                board.touch()
+        if steps == 0:
+            return 0
+
+        unit = self.unit
+        start = m.find_cell_at_point(self._X, self._Y)
+        prev = start
+        regions = m.regions_at(start.x, start.y) if start else []
+        x, y = path[steps - 1]
+        new_area = self._place(x, y, m, start, regions, cross_regions=False)
+        for x, y in path[: steps - 1]:
+            cell = m._peek(y, x)
+            if cell is not None and cell is not start:
+                for each in cell.enter_listeners:
+                    each(unit, cell)
+                for each in cell.exit_listeners:
+                    each(unit, cell)
+            if m.regions:
+                cell = cell or m[y, x]
+                here = m.regions_at(x, y)
+                if regions or here:
+                    _cross_regions(unit, regions, here, prev, cell)
+                regions = here
+                prev = cell
+        x, y = path[steps - 1]
+        last = m.regions_at(x, y) if new_area else []
+        if regions or last:
+            _cross_regions(unit, regions, last, prev, new_area)
+        return steps
+
+    def sight(self) -> float:
+        board = self.unit.get_component(Board)
+        return board.SIGHT_DIST if board is not None else Board.SIGHT_DIST
+
+    def visible_cells(self) -> frozenset[tuple[int, int]]:
+        # cached until the unit moves or the terrain within sight changes
+        m = self.map
+        x, y = self._X, self._Y
+        radius = self.sight()
+        r = int(radius)
+        key = (m, x, y, radius, m.layers[FLAGS].chunk_versions(x - r, y - r, x + r, y + r))
+        fov = self._fov
+        if fov is not None and fov[0] == key:
+            return fov[1]
+        cells = m.field_of_view(x, y, radius)
+        self._fov = (key, cells)
+        return cells
+
+    def can_see(self, x: int, y: int) -> bool:
+        return (x, y) in self.visible_cells()
+
+    def units_in_range(self, radius: float) -> list[Unit]:
+        # includes the unit itself
+        return self.map.range_table().units_within(self.unit, radius)
+
+    def distance_to(self, pos: Positional) -> float:
+        # read from the tick's range table, so repeated checks share rows
+        if pos.map is not self.map:
+            return math.inf
+        return self.map.range_table().distance(self.unit, pos.unit)
+
     def compute_distance(self, pos: Positional):
         if pos.map is self.map:
             return math.hypot(self._X - pos._X, self._Y - pos._Y)
@@ -386,35 +1486,143 @@ class Positional(Component):
 
     def select_line_targets(
         self, distance: float, targetPos: Positional, radius: float = 1.0
-    ):
+    ) -> list[Unit]:
         delta = self.compute_distance(targetPos)
         if delta == 0.0:
-            yield self.unit
-            yield targetPos.unit
-            return
-        dx = (targetPos._X - self._X) / delta
-        dy = (targetPos._Y - self._Y) / delta
-
-        acc = 0.0
-        x = self._X
-        y = self._Y
-
-        visited: set[Unit] = set()
-        going = True
-        while going:
-            if acc > distance:
-                going = False
-            for cell in self.map.find_cells_within_circle(int(x), int(y), radius):
-                for unit in cell.contained_units:
-                    if unit not in visited:
-                        visited.add(unit)
-                        yield unit
-            acc += radius
-            x = dx * acc
-            y = dy * acc
+            return [self.unit, targetPos.unit]
+        if delta == math.inf:
+            return []
+        return self.map.units_on_beam(
+            self._X,
+            self._Y,
+            targetPos._X - self._X,
+            targetPos._Y - self._Y,
+            distance,
+            math.ceil(radius),
+        )
+
+
+# The units of a map with their coordinates packed into arrays. Distances
+# from one unit to all others are computed in one pass of builtin map()
+# calls over the arrays and kept until the table is dropped.
+class RangeTable:
+    def __init__(self, m: Map, tick: int):
+        self.tick = tick
+        where: dict[Unit, MapCell] = {}
+        for bucket in m._index().values():
+            where.update(bucket)
+        units = sorted(where, key=lambda u: u.entity.eid)
+        self.units: list[Unit] = units
+        self.index: dict[Unit, int] = {u: i for i, u in enumerate(units)}
+        self.xs = array.array("i", [where[u].x for u in units])
+        self.ys = array.array("i", [where[u].y for u in units])
+        self._rows: dict[int, array.array] = {}
 
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def row(self, unit: Unit) -> array.array:
+        i = self.index[unit]
+        row = self._rows.get(i, None)
+        if row is None:
+            n = len(self.units)
+            dx = map(operator.sub, self.xs, itertools.repeat(self.xs[i], n))
+            dy = map(operator.sub, self.ys, itertools.repeat(self.ys[i], n))
+            row = self._rows[i] = array.array("d", map(math.hypot, dx, dy))
+        return row
+
+    def matrix(self) -> list[array.array]:
+        return [self.row(u) for u in self.units]
+
+    def distance(self, a: Unit, b: Unit) -> float:
+        j = self.index.get(b, None)
+        if j is None or a not in self.index:
+            return math.inf
+        return self.row(a)[j]
+
+    def within(self, unit: Unit, radius: float) -> list[bool]:
+        # a mask over `units`
+        return list(map(functools.partial(operator.ge, radius), self.row(unit)))
+
+    def units_within(self, unit: Unit, radius: float) -> list[Unit]:
+        if unit not in self.index:
+            return []
+        return list(itertools.compress(self.units, self.within(unit, radius)))
+
+    def nearest(self, unit: Unit, k: int) -> list[Unit]:
+        if unit not in self.index:
+            return []
+        row = self.row(unit)
+        me = self.index[unit]
+        order = heapq.nsmallest(k + 1, range(len(row)), key=row.__getitem__)
+        return [self.units[i] for i in order if i != me][:k]
+
+
+### World
+
+
+class TimingWheel:
+    # Hierarchical timing wheel over judge ticks. Level L has SLOTS slots of
+    # SLOTS ** L ticks each; an entry is kept at the lowest level whose
+    # slot holds its tick given the current one, and moves down a level
+    # when the wheel reaches its slot, so advancing costs O(due entries)
+    # plus one slot per level every SLOTS ** L ticks. Entries are not
+    # removed when cancelled; consumers skip stale ones.
+    BITS = 6
+    SLOTS = 1 << BITS
+    LEVELS = 4
+
+    def __init__(self, tick: int = 0):
+        # the next tick to advance
+        self.tick = tick
+        self.slots: list[list[list[tuple[int, typing.Any]]]] = [
+            [[] for _ in range(self.SLOTS)] for _ in range(self.LEVELS)
+        ]
+        # entries too far ahead for the top level
+        self.overflow: list[tuple[int, typing.Any]] = []
+        # entries placed so far, moves between levels included
+        self.placed = 0
 
-### GameState
+    def __len__(self) -> int:
+        return sum(map(len, itertools.chain(*self.slots))) + len(self.overflow)
+
+    def add(self, tick: int, item: typing.Any):
+        self._place(max(tick, self.tick), item)
+
+    def _place(self, tick: int, item: typing.Any):
+        self.placed += 1
+        bits = self.BITS
+        now = self.tick
+        for level in range(self.LEVELS):
+            shift = bits * (level + 1)
+            if tick >> shift == now >> shift:
+                slot = (tick >> (bits * level)) & (self.SLOTS - 1)
+                self.slots[level][slot].append((tick, item))
+                return
+        self.overflow.append((tick, item))
+
+    def advance(self, tick: int) -> list[typing.Any]:
+        # the items due up to `tick`, in tick order
+        due: list[typing.Any] = []
+        bits, mask = self.BITS, self.SLOTS - 1
+        while self.tick <= tick:
+            now = self.tick
+            if now & ((1 << (bits * self.LEVELS)) - 1) == 0 and self.overflow:
+                entries, self.overflow = self.overflow, []
+                for entry in entries:
+                    self._place(*entry)
+            for level in range(self.LEVELS - 1, 0, -1):
+                if now & ((1 << (bits * level)) - 1) == 0:
+                    slot = self.slots[level]
+                    index = (now >> (bits * level)) & mask
+                    entries, slot[index] = slot[index], []
+                    for entry in entries:
+                        self._place(*entry)
+            slot = self.slots[0]
+            entries, slot[now & mask] = slot[now & mask], []
+            due.extend(item for _, item in entries)
+            self.tick = now + 1
+        return due
 
 
 class EffectPredicate(typing_extensions.Protocol):
@@ -427,22 +1635,156 @@ class Logger(typing_extensions.Protocol):
         ...
 
 
-class _GameStateType:
-    def __init__(self):
+class World:
+    # runtime-only state, rebuilt rather than saved by luluwaku.snapshot
+    __transient__ = (
+        "archetypes",
+        "_queries",
+        "entities",
+        "_loggers",
+        "dirty",
+        "journal",
+        "judged",
+    )
+
+    def __init__(self, seed: int | None = None):
+        self.random = random.Random(seed)
         self.groups: dict[str, Group] = {}
         self.units: dict[str, Unit] = {}
         self._effect_loop: deque[Effect] = deque()
         self._effect_loop_cache: deque[Effect] = deque()
         self._loggers: list[Logger] = []
+        self.archetypes: dict[tuple[type, ...], Archetype] = {}
+        self._queries: dict[
+            tuple[type, ...], list[tuple[Archetype, tuple[array.array[int], ...]]]
+        ] = {}
+        self._effects_by_type: dict[type, dict[Effect, None]] = {}
+        self._effects_by_key: dict[tuple[type, typing.Hashable], dict[Effect, None]] = {}
+        self.tick = 0
+        self._judging = False
+        self._parked: dict[Effect, None] = {}
+        self._waiting: dict[typing.Hashable, dict[Effect, None]] = {}
+        # parked effects with a wake tick and buffs with an expiry
+        self._timers = TimingWheel()
+        self.entities: dict[int, Entity] = {}
+        self._next_eid = 0
+        # hits submitted during a judge, resolved together at its end
+        self._attacks: list[tuple[Unit, Unit, Damage]] = []
+        # paths submitted during a judge, moved together at its end
+        self._moves: dict[Positional, tuple[list[tuple[int, int]], Board | None]] = {}
+        # dirty objects and spawn/despawn records, only kept while a
+        # snapshot writer is attached
+        self.dirty: set[typing.Any] | None = None
+        self.journal: list[tuple[str, typing.Any]] | None = None
+        self.judged = Event()
+        self.boards: BoardTable | None = None
+
+    def board_table(self) -> BoardTable:
+        table = self.boards
+        if table is None:
+            table = self.boards = BoardTable(self)
+            self.track(self)
+        return table
+
+    def spawn(self, e: Entity, eid: int = -1):
+        key = e.__components__
+        arch = self.archetypes.get(key, None)
+        if arch is None:
+            arch = self.archetypes[key] = Archetype(e.__metadata__)
+            self._queries.clear()
+        if eid == -1:
+            eid = self._next_eid
+            self._next_eid += 1
+            self.track(self)
+        e.world = self
+        e.eid = eid
+        e._archetype = arch
+        e._row = arch.add(e)
+        self.entities[eid] = e
+        if self.journal is not None:
+            self.journal.append(("spawn", e))
+
+    def despawn(self, e: Entity):
+        for c in e.components:
+            if c is not None:
+                c.despawned()
+        e._archetype.remove(e)
+        # the row now belongs to another entity
+        del e._archetype, e._row
+        del self.entities[e.eid]
+        if self.journal is not None:
+            self.journal.append(("despawn", e.eid))
+
+    # The world itself is tracked when its effect queues, effect indexes or
+    # timers change; luluwaku.snapshot only writes its tick otherwise.
+    def track(self, o: typing.Any):
+        dirty = self.dirty
+        if dirty is not None:
+            dirty.add(o)
+
+    def query(self, *types: type) -> typing.Iterator[tuple]:
+        plan = self._queries.get(types, None)
+        if plan is None:
+            plan = self._queries[types] = []
+            for arch in self.archetypes.values():
+                slots = arch.resolve(types)
+                if slots is not None:
+                    plan.append((arch, slots))
+        for arch, slots in plan:
+            yield from arch.select(slots)
 
     def add_effect(self, eff: Effect):
         if isinstance(eff, CompositeEffect):
             for subeff in eff.effects:
                 self.add_effect(subeff)
         else:
+            eff.world = self
+            self.track(self)
             self._effect_loop.append(eff)
+            self._index_effect(eff)
             eff.on_start()
 
+    def _index_effect(self, eff: Effect):
+        t = type(eff)
+        bucket = self._effects_by_type.get(t, None)
+        if bucket is None:
+            bucket = self._effects_by_type[t] = {}
+        bucket[eff] = None
+        if t.__index_keys__:
+            key = (t, eff.index_key())
+            bucket = self._effects_by_key.get(key, None)
+            if bucket is None:
+                bucket = self._effects_by_key[key] = {}
+            bucket[eff] = None
+
+    def _unindex_effect(self, eff: Effect):
+        t = type(eff)
+        bucket = self._effects_by_type[t]
+        del bucket[eff]
+        if not bucket:
+            del self._effects_by_type[t]
+        if t.__index_keys__:
+            key = (t, eff.index_key())
+            bucket = self._effects_by_key[key]
+            del bucket[eff]
+            if not bucket:
+                del self._effects_by_key[key]
+
+    def effects_of(self, t: typing.Type[_E]) -> tuple[_E, ...]:
+        return tuple(self._effects_by_type.get(t, ()))  # type: ignore
+
+    def find_effect(self, t: typing.Type[_E], key: typing.Hashable) -> _E | None:
+        bucket = self._effects_by_key.get((t, key), None)
+        if bucket:
+            return next(iter(bucket))  # type: ignore
+        return None
+
+    def add_logger(self, logger: Logger):
+        self._loggers.append(logger)
+
+    def remove_logger(self, logger: Logger):
+        self._loggers.remove(logger)
+
     def log(self, msg: str, *unames: str, public: bool = True):
         for each in self._loggers:
             each(msg, unames, public)
@@ -454,26 +1796,329 @@ class _GameStateType:
         for eff in self._effect_loop_cache:
             if f(eff):
                 yield eff
+        for eff in self._parked:
+            if f(eff):
+                yield eff
+
+    def park(self, eff: Effect, signals: tuple[typing.Hashable, ...], tick: int = -1):
+        if tick != -1:
+            tick = max(tick, self.tick + 1 if self._judging else self.tick)
+        self.track(self)
+        self._parked[eff] = None
+        eff._signals = signals
+        eff._wake_at = tick
+        for signal in signals:
+            waiting = self._waiting.get(signal, None)
+            if waiting is None:
+                waiting = self._waiting[signal] = {}
+            waiting[eff] = None
+        if tick != -1:
+            self._timers.add(tick, eff)
+
+    def _unpark(self, eff: Effect):
+        del self._parked[eff]
+        for signal in eff._signals:
+            waiting = self._waiting.get(signal, None)
+            if waiting is not None:
+                waiting.pop(eff, None)
+                if not waiting:
+                    del self._waiting[signal]
+        eff._signals = ()
+        eff._wake_at = -1
+
+    def signal(self, signal: typing.Hashable):
+        waiting = self._waiting.pop(signal, None)
+        if not waiting:
+            return
+        self.track(self)
+        queue = self._effect_loop_cache if self._judging else self._effect_loop
+        for eff in waiting:
+            self._unpark(eff)
+            queue.append(eff)
+
+    ## Buffs
+
+    def add_buff(self, target: Unit, buff: Buff) -> Buff:
+        # returns the buff now running: `buff`, or the running buff of the
+        # same stack_key it was stacked onto
+        board = target[Board]
+        running = None
+        key = buff.stack_key()
+        same = [
+            other
+            for other in board.buffs
+            if other.stacking == buff.stacking and other.stack_key() == key
+        ]
+        if buff.stacking != Buff.INDEPENDENT:
+            running = same[0] if same else None
+        elif len(same) >= buff.max_stacks:
+            # make room by ending the instance that ends first
+            ending = min(same, key=lambda b: (b.expires < 0, b.expires))
+            self.remove_buff(ending)
+        start = self.tick + 1 if self._judging else self.tick
+        if running is None:
+            buff.target = target
+            buff.stacks = 1
+            buff.expires = -1 if buff.duration < 0 else start + buff.duration
+            buff.on_start(target)
+            self._apply_buff(board, buff)
+            running = buff
+        else:
+            if running.stacks < running.max_stacks:
+                running.stacks += 1
+                board.remove_modifiers(running)
+                self._apply_buff(board, running)
+            if running.duration < 0:
+                return running
+            if running.stacking == Buff.EXTEND:
+                running.expires += buff.duration
+            else:
+                running.expires = start + buff.duration
+        if running.expires >= 0 and not 0 <= running._due <= running.expires:
+            # one wheel entry per buff; when it is due before the buff
+            # expires, judge schedules the buff again
+            running._due = running.expires
+            self._timers.add(running.expires, running)
+            self.track(self)
+        return running
+
+    def _apply_buff(self, board: Board, buff: Buff):
+        stacks = buff.stacks
+        for m in buff.modifiers():
+            board.add_modifier(
+                Modifier(m.stat, m.flat * stacks, m.percent * stacks, source=buff)
+            )
+
+    def remove_buff(self, buff: Buff):
+        target = buff.target
+        if target is None:
+            return
+        buff.target = None
+        buff.expires = -1
+        buff._due = -1
+        if self.entities.get(target.entity.eid, None) is target.entity:
+            buff.on_end(target)
+
+    ## Attacks
+
+    def intend_attack(self, attacker: Unit, target: Unit, damage: Damage):
+        # target needs a DamanageAccepter
+        self._attacks.append((attacker, target, damage))
+
+    def _resolve_attacks(self):
+        # Resolves the hits of the tick in submission order exactly as
+        # Dodger.dodge then DamanageAccepter.on_damage would, drawing the
+        # same rolls from the world random and applying HP per damage
+        # term; the components of each target are only looked up once.
+        # Accepters and dodgers overriding these methods are called as
+        # they are.
+        hits = self._attacks
+        self._attacks = []
+        roll = self.random.random
+        tick = self.tick
+        dodge = Dodger.dodge
+        on_damage = DamanageAccepter.on_damage
+        targets: dict[Unit, tuple[Board, DamanageAccepter, Dodger | None]] = {}
+        for attacker, target, damage in hits:
+            components = targets.get(target, None)
+            if components is None:
+                components = targets[target] = (
+                    target[Board],
+                    target[DamanageAccepter],
+                    target.get_component(Dodger),
+                )
+            board, da, dodger = components
+            focus = damage.focus
+            if dodger is not None:
+                if type(dodger).dodge is not dodge:
+                    if dodger.dodge(attacker, damage):
+                        continue
+                elif focus <= 3 * board.SPR and roll() > get_ratio(
+                    focus - 0.2 * board.SPR - 0.7 * board.DEX - 0.1 * board.CON
+                ):
+                    continue
+            if type(da).on_damage is not on_damage:
+                da.on_damage(attacker, damage)
+                continue
+            if not da.enable:
+                continue
+            da.touch()
+            physical = damage.physical_damage
+            magical = damage.magical_damage
+            if roll() > get_ratio(1 + 0.9 * board.SPR * 0.6 * board.DEX - focus):
+                physical *= 2
+                magical *= 2
+            physical = da.physical_shields.absorb(physical, tick)
+            magical = da.magical_shields.absorb(magical, tick)
+            if physical != 0:
+                board.apply_HP(board.HP - physical)
+            if magical != 0:
+                board.apply_HP(board.HP - magical)
+            if damage.real_damage != 0:
+                board.apply_HP(board.HP - damage.real_damage)
+
+    ## Movement
+
+    def intend_move(
+        self,
+        pos: Positional,
+        path: list[tuple[int, int]],
+        board: Board | None = None,
+    ):
+        # replaces an earlier intent of the same unit in this tick
+        self._moves[pos] = (path, board)
+
+    def _resolve_moves(self):
+        # All intents of the tick advance together, one step per round. In a
+        # round, a unit may not enter a cell holding CELL_CAPACITY units
+        # after the round, nor swap cells with another unit; contested
+        # cells go to the lowest entity id. A blocked unit stops where it
+        # is, which may block others in turn, so each round is repeated
+        # until no more units are blocked. The walked paths are then
+        # committed in entity id order.
+        moves = sorted(self._moves.items(), key=lambda item: item[0].entity.eid)
+        self._moves = {}
+        walkers: list[tuple[Positional, list[tuple[int, int]], Board | None]] = []
+        for pos, (path, board) in moves:
+            if board is not None:
+                path = path[: pos.affordable_steps(path, board)]
+            if path:
+                walkers.append((pos, path, board))
+        if not walkers:
+            return
+        Cell = typing.Tuple[Map, int, int]
+        occupancy: dict[Cell, int] = {}
+
+        def count(key: Cell) -> int:
+            n = occupancy.get(key, None)
+            if n is None:
+                cell = key[0]._peek(key[2], key[1])
+                n = occupancy[key] = len(cell.contained_units) if cell else 0
+            return n
+
+        at = [(pos.map, pos._X, pos._Y) for pos, _, _ in walkers]
+        walked = [0] * len(walkers)
+        active = list(range(len(walkers)))
+        step = 0
+        while active:
+            active = [i for i in active if step < len(walkers[i][1])]
+            target = {i: (walkers[i][0].map, *walkers[i][1][step]) for i in active}
+            moving = set(active)
+            changed = True
+            while changed:
+                changed = False
+                leaving: dict[Cell, list[int]] = {}
+                entering: dict[Cell, list[int]] = {}
+                for i in moving:
+                    leaving.setdefault(at[i], []).append(i)
+                    entering.setdefault(target[i], []).append(i)
+                blocked = set()
+                for i in moving:
+                    for j in leaving.get(target[i], ()):
+                        if target[j] == at[i] and j != i:
+                            blocked.add(i)
+                for key, incoming in entering.items():
+                    room = walkers[incoming[0]][0].map.CELL_CAPACITY - (
+                        count(key) - len(leaving.get(key, ()))
+                    )
+                    incoming.sort()
+                    blocked.update(incoming[max(room, 0) :])
+                if blocked:
+                    moving -= blocked
+                    changed = True
+            for i in moving:
+                occupancy[at[i]] = count(at[i]) - 1
+                occupancy[target[i]] = count(target[i]) + 1
+                at[i] = target[i]
+                walked[i] += 1
+            active = sorted(moving)
+            step += 1
+
+        for (pos, path, board), n in zip(walkers, walked):
+            if n:
+                pos.commit_path(path[:n], board)
 
     def judge(self):
         cache = self._effect_loop_cache
         loop = self._effect_loop
-        while loop:
-            eff = loop.popleft()
-            if eff.on_step():
-                cache.append(eff)
+        tick = self.tick
+        timers = self._timers
+        placed = timers.placed
+        due = timers.advance(tick)
+        if loop or due or timers.placed != placed:
+            self.track(self)
+        for o in due:
+            # effects woken by a signal and buffs whose expiry moved earlier
+            # leave stale entries
+            if isinstance(o, Buff):
+                if o.target is None or o._due > tick:
+                    continue
+                if o.expires <= tick:
+                    self.remove_buff(o)
+                else:
+                    o._due = o.expires
+                    timers.add(o.expires, o)
+            elif 0 <= o._wake_at <= tick and o in self._parked:
+                self._unpark(o)
+                loop.append(o)
+        self._judging = True
+        try:
+            while loop:
+                eff = loop.popleft()
+                if eff.on_step():
+                    if eff not in self._parked:
+                        cache.append(eff)
+                else:
+                    if eff in self._parked:
+                        self._unpark(eff)
+                    self._unindex_effect(eff)
+        finally:
+            self._judging = False
+        if self._attacks:
+            self._resolve_attacks()
+        if self._moves:
+            self._resolve_moves()
         (self._effect_loop_cache, self._effect_loop) = (
             self._effect_loop,
             self._effect_loop_cache,
         )
+        self.tick = tick + 1
+        self.judged()
 
 
-GameState = _GameStateType()
+_GameStateType = World
+GameState = World()
 
 ### Step
 
 
 class Effect(abc.ABC):
+    world: World
+
+    # attribute names identifying an effect; see World.find_effect
+    __index_keys__: tuple[str, ...] = ()
+
+    def index_key(self) -> typing.Hashable:
+        keys = self.__index_keys__
+        if len(keys) == 1:
+            return getattr(self, keys[0])
+        return tuple(getattr(self, k) for k in keys)
+
+    # scheduler bookkeeping, see World.park
+    _signals: tuple[typing.Hashable, ...] = ()
+    _wake_at: int = -1
+
+    def wait(self, *signals: typing.Hashable, timeout: int | None = None) -> bool:
+        world = self.world
+        tick = -1 if timeout is None else world.tick + timeout
+        world.park(self, signals, tick)
+        return True
+
+    def sleep(self, ticks: int) -> bool:
+        world = self.world
+        world.park(self, (), world.tick + ticks)
+        return True
+
     @abc.abstractmethod
     def on_step(self) -> bool:
         raise NotImplementedError
@@ -484,8 +2129,11 @@ class Effect(abc.ABC):
     def on_end(self) -> None:
         pass
 
-    def submit(self):
-        GameState.add_effect(self)
+    def submit(self, world: World | None = None):
+        (world or GameState).add_effect(self)
+
+
+_E = typing.TypeVar("_E", bound=Effect)
 
 
 class CompositeEffect(Effect):
@@ -524,7 +2172,7 @@ class AttackEffect(Effect):
             targets = attacker[Positional].select_line_targets(
                 self.distance, target[Positional], self.aoe
             )
-        elif attacker[Positional].compute_distance(target[Positional]) <= self.distance:
+        elif attacker[Positional].distance_to(target[Positional]) <= self.distance:
             targets = [target]
         else:
             targets = []
@@ -532,19 +2180,71 @@ class AttackEffect(Effect):
             if Group.same_group(attacker, target):
                 continue
             damage = self.create_damage(attacker, target)
-            da = target.get_component(DamanageAccepter)
-            if not da:
+            if not target.get_component(DamanageAccepter):
                 return False
-            if dodger := target.get_component(Dodger):
-                if dodger.dodge(attacker, damage):
-                    continue
-            da.on_damage(attacker, damage)
+            self.world.intend_attack(attacker, target, damage)
         return False
 
 
 ## Board
 
 
+@dataclass(eq=False)
+class Modifier:
+    # the stat is (base + sum of flat) * (1 + sum of percent) over the
+    # modifiers on it; `source` (an item, a Buff, ...) removes them together
+    stat: str
+    flat: float = 0.0
+    percent: float = 0.0
+    source: typing.Any = None
+
+
+STATS = ("STR", "CON", "DEX", "INT", "SPR", "CHR", "ATTACK_DIST", "SIGHT_DIST")
+
+# derived stat -> (the stats it is computed from, formula, pool clamped to it)
+DERIVED: dict[str, tuple[tuple[str, ...], typing.Callable[[Board], float], str]] = {
+    "MAX_HP": (("CON",), lambda b: b.CON, "HP"),
+    "MAX_MP": (("SPR",), lambda b: b.SPR / 2, "MP"),
+    "MAX_EFFORTS": (
+        ("CON", "SPR"),
+        lambda b: 10 + int(0.7 * b.CON) + int(0.3 * b.SPR),
+        "EFFORTS",
+    ),
+}
+
+_DEPENDENTS: dict[str, list[str]] = {}
+# pool -> the derived stat it is clamped to
+_POOLS: dict[str, str] = {}
+for _name, (_inputs, _, _pool) in DERIVED.items():
+    for _input in _inputs:
+        _DEPENDENTS.setdefault(_input, []).append(_name)
+    _POOLS[_pool] = _name
+del _name, _inputs, _input, _pool
+
+
+def _derived_stat(name: str) -> property:
+    def get(self: Board):
+        return self._derive(name)
+
+    return property(get)
+
+
+def _pool_stat(name: str) -> property:
+    # a pool read settles its maximum first, so it is never seen above it
+    derived = _POOLS[name]
+    stored = "_" + name
+
+    def get(self: Board):
+        if derived in self._dirty:
+            self._derive(derived)
+        return getattr(self, stored)
+
+    def set(self: Board, value):
+        setattr(self, stored, value)
+
+    return property(get, set)
+
+
 class Board(Component):
     STR: float = 0.0
     CON: float = 0.0
@@ -554,72 +2254,360 @@ class Board(Component):
     CHR: float = 0.0
 
     ATTACK_DIST: float = 4
-
-    EFFORTS: int = 10
-    MAX_EFFORTS: int = 10
-
-    HP: float = 0
-    MP: float = 0
-
-    MAX_HP: float = 0
-    MAX_MP: float = 0
+    SIGHT_DIST: float = 8
+
+    EFFORTS = typing.cast(int, _pool_stat("EFFORTS"))
+    HP = typing.cast(float, _pool_stat("HP"))
+    MP = typing.cast(float, _pool_stat("MP"))
+    _EFFORTS: int = 10
+    _HP: float = 0.0
+    _MP: float = 0.0
+
+    # derived stats are computed on read, once their inputs changed
+    MAX_EFFORTS = typing.cast(int, _derived_stat("MAX_EFFORTS"))
+    MAX_HP = typing.cast(float, _derived_stat("MAX_HP"))
+    MAX_MP = typing.cast(float, _derived_stat("MAX_MP"))
+    _MAX_EFFORTS: int = 10
+    _MAX_HP: float = 0.0
+    _MAX_MP: float = 0.0
 
     alive: bool = True
 
     on_death: Event
     buffs: set[Buff]
+    base: dict[str, float]
+    modifiers: dict[str, list[Modifier]]
+    # stat -> (sum of flat, sum of percent) of its modifiers
+    _totals: dict[str, tuple[float, float]]
+    _dirty: set[str]
 
     def init(self):
         self.on_death = Event()
+        self.buffs = set()
+        self.base = {}
+        self.modifiers = {}
+        self._totals = {}
+        self._dirty = set(DERIVED)
+
+    ## Modifiers
+
+    def add_modifier(self, modifier: Modifier):
+        if modifier.stat not in STATS and modifier.stat not in DERIVED:
+            raise ValueError(f"no modifiable stat {modifier.stat!r}")
+        stat = modifier.stat
+        self.modifiers.setdefault(stat, []).append(modifier)
+        flat, percent = self._totals.get(stat, (0.0, 0.0))
+        self._totals[stat] = (flat + modifier.flat, percent + modifier.percent)
+        self._update(stat)
+
+    def remove_modifiers(self, source: typing.Any) -> list[Modifier]:
+        removed: list[Modifier] = []
+        for stat, modifiers in list(self.modifiers.items()):
+            kept = [m for m in modifiers if m.source is not source]
+            if len(kept) == len(modifiers):
+                continue
+            gone = [m for m in modifiers if m.source is source]
+            removed.extend(gone)
+            if kept:
+                self.modifiers[stat] = kept
+                flat, percent = self._totals[stat]
+                self._totals[stat] = (
+                    flat - sum(m.flat for m in gone),
+                    percent - sum(m.percent for m in gone),
+                )
+            else:
+                # back to exact zeros once the last modifier is gone
+                del self.modifiers[stat]
+                del self._totals[stat]
+            self._update(stat)
+        return removed
+
+    def _modified(self, stat: str, value: float) -> float:
+        totals = self._totals.get(stat, None)
+        if totals is None:
+            return value
+        return (value + totals[0]) * (1 + totals[1])
+
+    def _update(self, stat: str):
+        # recomputed from the base and the modifier totals rather than
+        # adjusted in place, so no rounding error is left on the stat
+        if stat in DERIVED:
+            self._mark(stat)
+        else:
+            setattr(self, stat, self._modified(stat, self.base.get(stat, getattr(Board, stat))))
+            for name in _DEPENDENTS.get(stat, ()):
+                self._mark(name)
+            if stat == "SIGHT_DIST":
+                pos = self.get_component(Positional)
+                if pos is not None:
+                    pos.map._sight_changed(pos.unit)
+        self.touch()
+
+    def _mark(self, name: str):
+        self._dirty.add(name)
+
+    def _derive(self, name: str):
+        if name not in self._dirty:
+            return getattr(self, "_" + name)
+        self._dirty.discard(name)
+        _, formula, pool = DERIVED[name]
+        value = type(getattr(Board, "_" + name))(self._modified(name, formula(self)))
+        setattr(self, "_" + name, value)
+        setattr(self, "_" + pool, clamp(getattr(self, "_" + pool), 0, value))
+        self.touch()
+        return value
+
+    def _settle(self):
+        for name in list(self._dirty):
+            self._derive(name)
+
+    ## Stats
+
+    def _set_base(self, stat: str, value: float):
+        self.base[stat] = value
+        self._update(stat)
 
     def apply_STR(self, value: float):
-        self.STR = value
+        self._set_base("STR", value)
 
     def apply_CON(self, value: float):
-        self.CON = value
-        self.MAX_HP = value
-        self.HP = clamp(self.HP, 0, self.MAX_HP)
-
-        self.MAX_EFFORTS = 10 + int(0.7 * value) + int(0.3 * self.SPR)
-        self.EFFORTS = clamp(self.EFFORTS, 0, self.MAX_EFFORTS)
+        self._set_base("CON", value)
 
     def apply_DEX(self, value: float):
-        self.DEX = value
+        self._set_base("DEX", value)
 
     def apply_INT(self, value: float):
-        self.INT = value
+        self._set_base("INT", value)
 
     def apply_SPR(self, value: float):
-        self.SPR = value
-        self.MAX_MP = value / 2
-        self.MP = clamp(self.MP, 0, self.MAX_MP)
-
-        self.MAX_EFFORTS = 10 + int(0.7 * self.CON) + int(0.3 * value)
-        self.EFFORTS = clamp(self.EFFORTS, 0, self.MAX_EFFORTS)
+        self._set_base("SPR", value)
 
     def apply_CHR(self, value: float):
-        self.CHR = value
+        self._set_base("CHR", value)
 
     def apply_HP(self, value: float):
         if not self.alive:
             return
         HP = self.HP = clamp(value, 0, self.MAX_HP)
+        self.touch()
         if HP == 0:
             self.alive = False
             self.on_death()
 
     def apply_ATTACK_DIST(self, value: float):
-        self.ATTACK_DIST = value
+        self._set_base("ATTACK_DIST", value)
+
+    def apply_SIGHT_DIST(self, value: float):
+        self._set_base("SIGHT_DIST", value)
 
     def consume_efforts(self, value: int):
         if not self.alive:
             return False
         if self.EFFORTS > value:
             self.EFFORTS -= value
+            self.touch()
             return True
         return False
 
 
+# Board stats of TableBoard components live in one BoardTable per world,
+# a column (array.array) per stat and a row per board, so turn maintenance
+# such as restoring efforts or regeneration is one pass over the columns.
+# Rows are kept in chunks of CHUNK rows, as terrain layers keep cells, and
+# a write to a board only tracks its chunk, so snapshot deltas carry that
+# chunk rather than every column.
+class BoardChunk:
+    def __init__(self, size: int):
+        self.columns = {
+            name: array.array(code, [_board_default(name)]) * size
+            for name, code in BoardTable.FIELDS.items()
+        }
+        self.columns["alive"] = array.array("B", bytes(size))
+        self.boards: list[TableBoard | None] = [None] * size
+        # rows with derived stats to compute before a pass over the columns
+        self.stale: set[int] = set()
+
+
+class BoardTable:
+    FIELDS: dict[str, str] = {
+        "STR": "d",
+        "CON": "d",
+        "DEX": "d",
+        "INT": "d",
+        "SPR": "d",
+        "CHR": "d",
+        "ATTACK_DIST": "d",
+        "SIGHT_DIST": "d",
+        "EFFORTS": "q",
+        "MAX_EFFORTS": "q",
+        "HP": "d",
+        "MP": "d",
+        "MAX_HP": "d",
+        "MAX_MP": "d",
+        "alive": "B",
+    }
+    CHUNK = 64
+
+    def __init__(self, world: World):
+        self.world = world
+        self.chunks: list[BoardChunk] = []
+        self.size = 0
+        self.free: list[int] = []
+
+    def locate(self, row: int) -> tuple[BoardChunk, int]:
+        return self.chunks[row // self.CHUNK], row % self.CHUNK
+
+    def allocate(self, board: TableBoard) -> int:
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = self.size
+            self.size += 1
+            if row % self.CHUNK == 0:
+                self.chunks.append(BoardChunk(self.CHUNK))
+        chunk, i = self.locate(row)
+        chunk.boards[i] = board
+        for name, column in chunk.columns.items():
+            column[i] = _board_default(name)
+        chunk.stale.add(i)
+        self.world.track(self)
+        self.world.track(chunk)
+        return row
+
+    def release(self, row: int):
+        chunk, i = self.locate(row)
+        chunk.boards[i] = None
+        chunk.stale.discard(i)
+        chunk.columns["alive"][i] = False
+        self.free.append(row)
+        self.world.track(self)
+        self.world.track(chunk)
+
+    def column(self, name: str) -> array.array:
+        # a copy of a column, one value per row
+        out = array.array(self.FIELDS[name])
+        for chunk in self.chunks:
+            out.extend(chunk.columns[name])
+        return out[: self.size]
+
+    def _settle(self):
+        for chunk in self.chunks:
+            for i in chunk.stale:
+                board = chunk.boards[i]
+                if board is not None:
+                    board._settle()
+            chunk.stale.clear()
+
+    def restore_efforts(self):
+        # EFFORTS back to MAX_EFFORTS for every living board
+        self._settle()
+        for chunk in self.chunks:
+            columns = chunk.columns
+            efforts = columns["EFFORTS"]
+            efforts[:] = array.array(
+                "q",
+                [
+                    m if a else e
+                    for e, m, a in zip(efforts, columns["MAX_EFFORTS"], columns["alive"])
+                ],
+            )
+            self.world.track(chunk)
+
+    def regen(self, hp: float = 0.0, mp: float = 0.0):
+        # adds hp and mp to every living board within [0, MAX]; boards
+        # brought to 0 HP die as with Board.apply_HP
+        self._settle()
+        if hp:
+            self._add("HP", hp)
+        if hp < 0:
+            for chunk in self.chunks:
+                alive = chunk.columns["alive"]
+                HP = chunk.columns["HP"]
+                for i, board in enumerate(chunk.boards):
+                    if board is not None and alive[i] and HP[i] == 0:
+                        alive[i] = False
+                        board.on_death()
+        if mp:
+            self._add("MP", mp)
+        for chunk in self.chunks:
+            self.world.track(chunk)
+
+    def _add(self, name: str, delta: float):
+        for chunk in self.chunks:
+            columns = chunk.columns
+            column = columns[name]
+            column[:] = array.array(
+                "d",
+                [
+                    (0.0 if v + delta < 0 else top if v + delta > top else v + delta)
+                    if a
+                    else v
+                    for v, top, a in zip(column, columns["MAX_" + name], columns["alive"])
+                ],
+            )
+
+
+def _board_field(name: str) -> str:
+    # the Board attribute holding a column's value
+    return "_" + name if name in DERIVED or name in _POOLS else name
+
+
+def _board_default(name: str) -> typing.Any:
+    return getattr(Board, _board_field(name))
+
+
+def _table_field(name: str) -> property:
+    def get(self: TableBoard):
+        return self._chunk.columns[name][self._index]
+
+    def set(self: TableBoard, value):
+        self._chunk.columns[name][self._index] = value
+
+    return property(get, set)
+
+
+class TableBoard(Board):
+    # a Board whose stats are a row of the world BoardTable
+    _table: BoardTable
+    _row: int
+    # the chunk holding the row and the row in it
+    _chunk: BoardChunk
+    _index: int
+
+    def init(self):
+        Board.init(self)
+        self._table = self.world.board_table()
+        self._row = self._table.allocate(self)
+        self._chunk, self._index = self._table.locate(self._row)
+
+    def despawned(self):
+        self._table.release(self._row)
+
+    def _mark(self, name: str):
+        Board._mark(self, name)
+        self._chunk.stale.add(self._index)
+
+    def touch(self):
+        Board.touch(self)
+        chunk = self.__dict__.get("_chunk", None)
+        if chunk is not None:
+            self.world.track(chunk)
+
+    @property
+    def alive(self) -> bool:
+        return bool(self._chunk.columns["alive"][self._index])
+
+    @alive.setter
+    def alive(self, value: bool):
+        self._chunk.columns["alive"][self._index] = value
+
+
+for _name in BoardTable.FIELDS:
+    if _name != "alive":
+        setattr(TableBoard, _board_field(_name), _table_field(_name))
+del _name
+
+
 ## Battle System
 
 
@@ -634,73 +2622,150 @@ class Damage:
 @dataclass
 class Shield:
     value: float
+    # higher priorities absorb first; -1 never expires
+    priority: int = 0
+    expires: int = -1
+
+
+class ShieldPool:
+    # Shields absorb damage by priority, then oldest first. Depleted and
+    # expired shields leave `total` at once and the heaps lazily; the heaps
+    # are rebuilt when most of their entries are dead. Shields belong to
+    # the pool once added and are only changed through it.
+    def __init__(self):
+        self.total = 0.0
+        self._heap: list[tuple[int, int, Shield]] = []
+        self._expiry: list[tuple[int, int, Shield]] = []
+        self._seq = 0
+        # dead shields still in _heap, depleted ones still in _expiry
+        self._dead = 0
+        self._depleted = 0
+
+    def __len__(self) -> int:
+        return len(self._heap) - self._dead
+
+    def __iter__(self) -> typing.Iterator[Shield]:
+        # live shields in absorb order
+        return (shield for _, _, shield in sorted(self._heap) if shield.value > 0)
+
+    def add(self, shield: Shield):
+        if shield.value <= 0:
+            return
+        seq = self._seq
+        self._seq += 1
+        heapq.heappush(self._heap, (-shield.priority, seq, shield))
+        if shield.expires >= 0:
+            heapq.heappush(self._expiry, (shield.expires, seq, shield))
+        self.total += shield.value
+
+    def prune(self, now: int):
+        # drops the shields expired at tick `now`
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            shield = heapq.heappop(expiry)[2]
+            if shield.value > 0:
+                self.total -= shield.value
+                shield.value = 0
+                self._dead += 1
+            else:
+                self._depleted -= 1
+        self._collect()
+
+    def capacity(self, now: int) -> float:
+        self.prune(now)
+        return self.total
+
+    def absorb(self, damage: float, now: int) -> float:
+        # returns the damage left
+        self.prune(now)
+        heap = self._heap
+        while damage > 0 and heap:
+            shield = heap[0][2]
+            if shield.value <= 0:
+                heapq.heappop(heap)
+                self._dead -= 1
+                continue
+            if shield.value > damage:
+                shield.value -= damage
+                self.total -= damage
+                return 0
+            damage -= shield.value
+            self.total -= shield.value
+            shield.value = 0
+            heapq.heappop(heap)
+            if shield.expires >= 0:
+                self._depleted += 1
+        self._collect()
+        return damage
+
+    def _collect(self):
+        heap = self._heap
+        if len(heap) == self._dead:
+            # no rounding error is kept once all shields are gone
+            heap.clear()
+            self._expiry.clear()
+            self._dead = self._depleted = 0
+            self.total = 0.0
+            return
+        if self._dead > len(heap) // 2:
+            self._heap = [e for e in heap if e[2].value > 0]
+            heapq.heapify(self._heap)
+            self._dead = 0
+        if self._depleted > len(self._expiry) // 2:
+            self._expiry = [e for e in self._expiry if e[2].value > 0]
+            heapq.heapify(self._expiry)
+            self._depleted = 0
 
 
 class DamanageAccepter(Component):
     enable: bool
-    physical_shields: list[Shield]
-    magical_shields: list[Shield]
+    physical_shields: ShieldPool
+    magical_shields: ShieldPool
 
     def init(self):
         self.enable = True
-        self.physical_shields = []
-        self.magical_shields = []
+        self.physical_shields = ShieldPool()
+        self.magical_shields = ShieldPool()
 
     def set_enable(self, value: bool):
         self.enable = value
+        self.touch()
+
+    def add_shield(self, shield: Shield, magical: bool = False):
+        (self.magical_shields if magical else self.physical_shields).add(shield)
+        self.touch()
 
     def on_damage(self, attacker: Unit, damage: Damage):
         if not self.enable:
             return
+        self.touch()
         unit = self[Unit]
-        if random.random() > get_ratio(
-            1 + 0.9 * unit[Board].SPR * 0.6 * unit[Board].DEX - damage.focus
+        board = unit[Board]
+        if self.world.random.random() > get_ratio(
+            1 + 0.9 * board.SPR * 0.6 * board.DEX - damage.focus
         ):
             damage.physical_damage *= 2
             damage.magical_damage *= 2
 
-        for shield in self.physical_shields:
-            if damage.physical_damage <= 0:
-                break
-
-            if shield.value > damage.physical_damage:
-                shield.value -= damage.physical_damage
-                damage.physical_damage = 0
-                break
-            else:
-                damage.physical_damage -= shield.value
-                shield.value = 0
-
-        for shield in self.magical_shields:
-            if damage.magical_damage <= 0:
-                break
-
-            if shield.value > damage.magical_damage:
-                shield.value -= damage.magical_damage
-                damage.magical_damage = 0
-                break
-            else:
-                damage.magical_damage -= shield.value
-                shield.value = 0
+        now = self.world.tick
+        damage.physical_damage = self.physical_shields.absorb(damage.physical_damage, now)
+        damage.magical_damage = self.magical_shields.absorb(damage.magical_damage, now)
 
         if damage.physical_damage != 0:
-            unit[Board].apply_HP(unit[Board].HP - damage.physical_damage)
+            board.apply_HP(board.HP - damage.physical_damage)
         if damage.magical_damage != 0:
-            unit[Board].apply_HP(unit[Board].HP - damage.magical_damage)
+            board.apply_HP(board.HP - damage.magical_damage)
         if damage.real_damage != 0:
-            unit[Board].apply_HP(unit[Board].HP - damage.real_damage)
+            board.apply_HP(board.HP - damage.real_damage)
 
 
 class Dodger(Component):
     def dodge(self, attacker: Unit, damage: Damage):
-        unit = self[Unit]
-        if damage.focus > 3 * unit[Board].SPR:
+        board = self[Board]
+        if damage.focus > 3 * board.SPR:
             return False
-        if random.random() > get_ratio(
-            damage.focus
-            - 0.2 * unit[Board].SPR
-            - 0.7 * unit[Board].DEX
-            - 0.1 * unit[Board].CON
+        if self.world.random.random() > get_ratio(
+            damage.focus - 0.2 * board.SPR - 0.7 * board.DEX - 0.1 * board.CON
         ):
             return True
         return False
@@ -710,11 +2775,40 @@ class Dodger(Component):
 
 
 class Buff(abc.ABC):
+    # what applying a buff does to a running one of the same stack_key:
+    # REFRESH restarts its duration and EXTEND adds to it, and the running
+    # one gains a stack up to max_stacks; INDEPENDENT runs both, up to
+    # max_stacks instances, ending the one that ends first to make room
+    REFRESH = "refresh"
+    EXTEND = "extend"
+    INDEPENDENT = "independent"
+
+    # in judge ticks; -1 lasts until World.remove_buff
+    duration: int = -1
+    stacking: str = REFRESH
+    max_stacks: int = 1
+
+    target: Unit | None = None
+    stacks: int = 0
+    # the tick the buff ends at, -1 if not running or lasting
+    expires: int = -1
+    # the tick of the buff's timing wheel entry, -1 if none
+    _due: int = -1
+
+    def stack_key(self) -> typing.Hashable:
+        return type(self)
+
+    def modifiers(self) -> typing.Iterable[Modifier]:
+        # per stack; applied with the buff as source
+        return ()
+
     def on_start(self, target: Unit):
         target[Board].buffs.add(self)
 
     def on_end(self, target: Unit):
-        target[Board].buffs.remove(self)
+        board = target[Board]
+        board.buffs.remove(self)
+        board.remove_modifiers(self)
 
 
 ## Group
@@ -729,8 +2823,10 @@ class Group:
         self.owner = owner
         self.name = name
         self.units = []
-        assert name not in GameState.groups
-        GameState.groups[name] = self
+        world = owner.world
+        assert name not in world.groups
+        world.groups[name] = self
+        world.track(world)
         Group.join(owner, self)
 
     @staticmethod
@@ -744,21 +2840,28 @@ class Group:
         Group.leave(unit)
         group.units.append(unit)
         unit.group = group
-        GameState.log(f"加入队伍【{group.name}】", unit.uname, public=True)
+        unit.touch()
+        unit.world.track(group)
+        unit.world.log(f"加入队伍【{group.name}】", unit.uname, public=True)
 
     @staticmethod
     def leave(unit: Unit):
         g = unit.group
         if g is not None:
+            world = unit.world
             g.units.remove(unit)
-            GameState.log(f"离开队伍【{g.name}】", unit.uname, public=True)
+            world.log(f"离开队伍【{g.name}】", unit.uname, public=True)
             unit.group = None
+            unit.touch()
+            world.track(g)
             if not g.units:
-                GameState.groups.pop(g.name, None)
+                world.groups.pop(g.name, None)
+                world.track(world)
+                world.signal(("group", g.name))
             else:
                 if g.owner is unit:
                     g.owner = g.units[0]
-                    GameState.log(f"队伍【{g.name}】的队长变更为【{unit.uname}】", public=True)
+                    world.log(f"队伍【{g.name}】的队长变更为【{unit.uname}】", public=True)
 
 
 ## components/Skill
@@ -791,17 +2894,20 @@ class Caster(Component):
     def level_up(self, skill: Skill, value: float):
         if skill in self.learnt_skills:
             self.learnt_skills[skill] += value
+            self.touch()
 
     def learn(self, skill: Skill):
         if skill in self.learnt_skills:
             return False
         self.learnt_skills[skill] = 1.0
+        self.touch()
         return True
 
     def forget(self, skill: Skill):
         if skill not in self.learnt_skills:
             return False
         del self.learnt_skills[skill]
+        self.touch()
         return True
 
 
@@ -872,10 +2978,12 @@ class Bag(Component):
     def add_money(self, value: int):
         self.money += value
         self.money = clamp(self.money, 0, MAX_MONEY)
+        self.touch()
 
     def remove_money(self, value: int):
         self.money -= value
         self.money = clamp(self.money, 0, MAX_MONEY)
+        self.touch()
 
     def add_item(self, item: Item):
         if item in self._items:
@@ -884,6 +2992,7 @@ class Bag(Component):
             return False
         self._items.add(item)
         self.cur_capacity += item.weight
+        self.touch()
         item.on_install(self[Unit])
         return True
 
@@ -895,6 +3004,7 @@ class Bag(Component):
             return False
         self._items.remove(item)
         self.cur_capacity -= item.weight
+        self.touch()
         item.on_uninstall(self[Unit])
         return True
 
@@ -7,19 +7,23 @@ from luluwaku.items.book import Book
 class CureEffect(Effect):
     left_heal: float
     each_heal: float
+    interval: int
     target: Unit
 
-    def __init__(self, target: Unit, total_heal: float, each_heal: float):
+    def __init__(
+        self, target: Unit, total_heal: float, each_heal: float, interval: int = 1
+    ):
         self.target = target
         self.left_heal = total_heal
         self.each_heal = each_heal
+        self.interval = interval
 
     def on_step(self) -> bool:
         board = self.target[Board]
         if self.left_heal > self.each_heal:
             board.apply_HP(board.HP + self.each_heal)
             self.left_heal -= self.each_heal
-            return True
+            return self.sleep(self.interval)
         board.apply_HP(board.HP + self.left_heal)
         self.left_heal = 0
         return False
@@ -45,10 +49,10 @@ class Cure(Skill):
             and (targetUnit := target.get_component(Unit))
             and (level := emitter[Caster].level(self))
         ):
-            if emitter[Positional].compute_distance(
+            if emitter[Positional].distance_to(
                 targetUnit[Positional]
             ) > skill_distance(level):
-                GameState.log(f"目标距离过远，施法未能命中", emitter.uname)
+                emitter.world.log(f"目标距离过远，施法未能命中", emitter.uname)
                 return None
             board = targetUnit[Board]
             r = get_ratio(level + 0.1 * board.SPR + 0.9 * board.INT)
@@ -11,5 +11,5 @@ class Drug(Item):
         bag = unit[Bag]
         bag.remove_item(self)
         eff = self.use(unit)
-        eff.submit()
+        eff.submit(unit.world)
         return True
@@ -30,8 +30,9 @@ class Weapon(Item):
 
         if not self.is_equipped:
             self.is_equipped = True
+            src.world.track(self)
             self.on_equipped(src)
-            GameState.log(
+            src.world.log(
                 f"物品【{self.name}】已激活",
                 src.uname,
             )
@@ -41,8 +42,9 @@ class Weapon(Item):
     def on_deactivated(self, unit: Unit):
         if self.is_equipped:
             self.is_equipped = False
+            unit.world.track(self)
             self.on_unequipped(unit)
-            GameState.log(
+            unit.world.log(
                 f"物品【{self.name}】已取消",
                 unit.uname,
             )
@@ -13,19 +13,16 @@ class NormalSword(Weapon):
     def __init__(self, level: int) -> None:
         self.level = level
         self.weight = 1 + int(level // 2)
-        self.previous_ATK_DIST = 0
 
     def on_equipped(self, unit: Unit):
         board = unit[Board]
-        board.apply_STR(board.STR + STR_const + STR_factor * self.level)
-        board.apply_DEX(board.DEX + DEX_factor * self.level)
-        self.previous_ATK_DIST = board.ATTACK_DIST
+        board.add_modifier(
+            Modifier("STR", flat=STR_const + STR_factor * self.level, source=self)
+        )
+        board.add_modifier(Modifier("DEX", flat=DEX_factor * self.level, source=self))
 
     def on_unequipped(self, unit: Unit):
-        board = unit[Board]
-        board.apply_STR(board.STR - STR_const - STR_factor * self.level)
-        board.apply_DEX(board.DEX - DEX_factor * self.level)
-        board.apply_ATTACK_DIST(self.previous_ATK_DIST)
+        unit[Board].remove_modifiers(self)
 
     def get_name(self) -> str:
         return f"铁剑{self.level}"
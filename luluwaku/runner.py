@@ -0,0 +1,82 @@
+from __future__ import annotations
+import os
+import typing
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from luluwaku.core import World
+
+_R = typing.TypeVar("_R")
+
+WorldFactory = typing.Callable[[str], World]
+Command = typing.Callable[..., _R]
+
+## Worker side
+
+_factory: WorldFactory | None = None
+_worlds: dict[str, World] = {}
+
+
+def _init_shard(factory: WorldFactory):
+    global _factory
+    _factory = factory
+    _worlds.clear()
+
+
+def _run(room: str, command: Command[_R], args: tuple) -> _R:
+    world = _worlds.get(room, None)
+    if world is None:
+        assert _factory is not None
+        world = _worlds[room] = _factory(room)
+    return command(world, *args)
+
+
+def _close(room: str) -> bool:
+    return _worlds.pop(room, None) is not None
+
+
+def judge(world: World) -> int:
+    world.judge()
+    return world.tick
+
+
+## Parent side
+
+
+# Every room is owned by one shard (a single-worker process pool), so the
+# commands of a room always reach the process holding its World. Worlds are
+# created in the worker by `factory` the first time a room is used; commands
+# are picklable callables taking the World as their first argument.
+class WorldPool:
+    def __init__(self, factory: WorldFactory, shards: int | None = None, mp_context=None):
+        shards = shards or os.cpu_count() or 1
+        self._shards = [
+            ProcessPoolExecutor(
+                1, mp_context, initializer=_init_shard, initargs=(factory,)
+            )
+            for _ in range(shards)
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+
+    def shard_of(self, room: str) -> int:
+        return zlib.crc32(room.encode()) % len(self._shards)
+
+    def submit(self, room: str, command: Command[_R], *args) -> Future[_R]:
+        return self._shards[self.shard_of(room)].submit(_run, room, command, args)
+
+    def judge(self, room: str) -> Future[int]:
+        return self.submit(room, judge)
+
+    def judge_all(self, rooms: typing.Iterable[str]) -> dict[str, Future[int]]:
+        return {room: self.judge(room) for room in rooms}
+
+    def close(self, room: str) -> Future[bool]:
+        return self._shards[self.shard_of(room)].submit(_close, room)
+
+    def shutdown(self, wait: bool = True):
+        for shard in self._shards:
+            shard.shutdown(wait)
@@ -0,0 +1,210 @@
+from __future__ import annotations
+import array
+import builtins
+import collections
+import importlib
+import io
+import pickle
+import random
+import sys
+import typing
+from luluwaku import core
+from luluwaku.core import PList
+
+try:
+    # functions pickle cannot name, such as the damage creators of skills
+    # and other closures, can only be saved by value with dill
+    import dill
+except ImportError:
+    dill = None
+
+# Pickling of game state. Values are written with the C pickler, and again
+# with dill when they hold functions pickle cannot reference by name; dill's
+# output loads with the C unpickler as well. A `ref` hook lets the caller
+# replace objects (entities, components, ...) with references, which `loads`
+# hands to its `resolve` hook.
+#
+# Loading resolves names of this package, of the main script, of dill and
+# of the builtins, plus the objects given to `register`; other modules are
+# never imported. Classes defined in functions are written by name and found
+# among the subclasses of the types registered with `subclasses=True`.
+
+Ref = typing.Hashable
+
+_registry: dict[tuple[str, str], typing.Any] = {}
+_families: list[type] = []
+
+_PACKAGES = ("luluwaku", "dill")
+# builtins that would let a record run or load arbitrary code
+_UNSAFE_BUILTINS = frozenset(
+    [
+        "__import__",
+        "breakpoint",
+        "compile",
+        "eval",
+        "exec",
+        "globals",
+        "input",
+        "locals",
+        "open",
+        "vars",
+    ]
+)
+
+
+def register(t: typing.Any, subclasses: bool = False) -> typing.Any:
+    _registry[(t.__module__, t.__qualname__)] = t
+    if subclasses:
+        _families.append(t)
+    return t
+
+
+def _in_family(module: str, qualname: str) -> typing.Any:
+    stack = list(_families)
+    while stack:
+        each = stack.pop()
+        if each.__module__ == module and each.__qualname__ == qualname:
+            return each
+        stack.extend(each.__subclasses__())
+    return None
+
+
+def _module(module: str) -> typing.Any:
+    if module.partition(".")[0] in _PACKAGES:
+        if module.startswith("dill") and dill is None:
+            return None
+        return importlib.import_module(module)
+    if module == "__main__":
+        return sys.modules["__main__"]
+    return None
+
+
+def lookup(module: str, qualname: str) -> typing.Any:
+    found = _registry.get((module, qualname), None)
+    if found is not None:
+        return found
+    # what dill writes for the main module and for NoneType
+    if module == "__builtin__":
+        if qualname == "__main__":
+            return sys.modules["__main__"].__dict__
+        if qualname == "NoneType":
+            return type(None)
+    if module == "builtins":
+        if qualname not in _UNSAFE_BUILTINS and hasattr(builtins, qualname):
+            return getattr(builtins, qualname)
+    elif "<locals>" in qualname:
+        found = _in_family(module, qualname)
+    else:
+        found = _module(module)
+        for name in qualname.split(".") if found is not None else ():
+            found = getattr(found, name, None)
+    if found is None:
+        raise ValueError(f"{module}.{qualname} is not a loadable name")
+    _registry[(module, qualname)] = found
+    return found
+
+
+def _unresolved(ref: typing.Any) -> typing.Any:
+    # written in place of referenced objects; `loads` calls its `resolve`
+    # hook instead
+    raise ValueError(f"unresolved reference {ref!r}")
+
+
+def _no_ref(_: typing.Any) -> None:
+    return None
+
+
+## Encoding
+
+
+def _reduce(ref: typing.Callable[[typing.Any], Ref | None], obj: typing.Any) -> typing.Any:
+    r = ref(obj)
+    if r is not None:
+        return _unresolved, (r,)
+    if isinstance(obj, type) and "<locals>" in obj.__qualname__:
+        key = (obj.__module__, obj.__qualname__)
+        if _registry.get(key, None) is obj or _in_family(*key) is obj:
+            return lookup, (obj.__module__, obj.__qualname__)
+    return NotImplemented
+
+
+class _Pickler(pickle.Pickler):
+    # reducer_override is only consulted for objects pickle has no fast
+    # path for, unlike persistent_id which sees every int and string
+    def __init__(self, file: typing.IO[bytes], ref: typing.Callable[[typing.Any], Ref | None]):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.ref = ref
+
+    def reducer_override(self, obj: typing.Any) -> typing.Any:
+        return _reduce(self.ref, obj)
+
+
+if dill is not None:
+
+    class _DillPickler(dill.Pickler):
+        def __init__(self, file: typing.IO[bytes], ref: typing.Callable[[typing.Any], Ref | None]):
+            super().__init__(file, pickle.HIGHEST_PROTOCOL)
+            self.ref = ref
+
+        def reducer_override(self, obj: typing.Any) -> typing.Any:
+            return _reduce(self.ref, obj)
+
+
+def dumps(v: typing.Any, ref: typing.Callable[[typing.Any], Ref | None] | None = None) -> bytes:
+    ref = ref or _no_ref
+    buf = io.BytesIO()
+    try:
+        _Pickler(buf, ref).dump(v)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        if dill is None:
+            raise
+        buf = io.BytesIO()
+        _DillPickler(buf, ref).dump(v)
+    return buf.getvalue()
+
+
+## Decoding
+
+
+class Unpickler(pickle.Unpickler):
+    def __init__(
+        self,
+        file: typing.IO[bytes],
+        resolve: typing.Callable[[typing.Any], typing.Any] | None = None,
+    ):
+        super().__init__(file)
+        self.resolve = resolve or _unresolved
+
+    def find_class(self, module: str, name: str) -> typing.Any:
+        if module == __name__ and name == "_unresolved":
+            return self.resolve
+        return lookup(module, name)
+
+
+def loads(data: bytes, resolve: typing.Callable[[typing.Any], typing.Any] | None = None) -> typing.Any:
+    return Unpickler(io.BytesIO(data), resolve).load()
+
+
+## Registered types
+
+for _t in (
+    core.Entity,
+    core.Component,
+    core.Effect,
+    core.Buff,
+    core.Item,
+    core.Skill,
+    core.Region,
+    core.World,
+    PList,
+):
+    register(_t, subclasses=True)
+for _t in (
+    # what pickle needs for the containers and the world random
+    collections.deque,
+    array.array,
+    array._array_reconstructor,
+    random.Random,
+):
+    register(_t)
+del _t
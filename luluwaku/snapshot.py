@@ -0,0 +1,364 @@
+from __future__ import annotations
+import itertools
+import os
+import struct
+import typing
+import weakref
+from luluwaku.core import *
+from luluwaku import serializer
+from luluwaku.terrain import TerrainChunk, TerrainLayer
+
+# Snapshot files are a base record followed by delta records, pickled by
+# luluwaku.serializer with the ECS objects replaced by references. Entities,
+# components and map cells are referenced by entity id; objects of
+# `persistent_types` are shared between components and effects, so they are
+# saved once and referenced by an object id to keep their identity. Deltas
+# only write the world's effect queues and timers when the world tracked
+# itself, and its ticks always.
+
+persistent_types: tuple[type, ...] = (
+    Item,
+    Skill,
+    Group,
+    Buff,
+    TerrainLayer,
+    TerrainChunk,
+    BoardTable,
+    BoardChunk,
+)
+
+BASE = b"B"
+DELTA = b"D"
+_RECORD = struct.Struct("<cQ")
+
+PersistentId = typing.Tuple[typing.Any, ...]
+
+
+def state_of(o: typing.Any) -> dict[str, typing.Any]:
+    transient = getattr(type(o), "__transient__", ())
+    if not transient:
+        return o.__dict__
+    return {k: v for k, v in o.__dict__.items() if k not in transient}
+
+
+## Writing
+
+_kinds: dict[type, str] = {}
+
+
+def _kind_of(t: type) -> str:
+    if issubclass(t, Component):
+        return "c"
+    if issubclass(t, Entity):
+        return "e"
+    if issubclass(t, MapCell):
+        return "cell"
+    if issubclass(t, World):
+        return "w"
+    if issubclass(t, persistent_types):
+        return "o"
+    return ""
+
+
+class _Encoder:
+    def __init__(
+        self,
+        world: World,
+        oids: weakref.WeakKeyDictionary[typing.Any, int],
+        counter: typing.Iterator[int],
+    ):
+        self.world = world
+        self.oids = oids
+        self.counter = counter
+        self.pending: list[typing.Any] = []
+        # the random state last written; an unchanged one is written empty
+        self.random_state = b""
+
+    def ref(self, obj: typing.Any) -> PersistentId | None:
+        kind = _kinds.get(type(obj), None)
+        if kind is None:
+            kind = _kinds[type(obj)] = _kind_of(type(obj))
+        if kind == "":
+            return None
+        if kind == "c":
+            e = obj.__dict__.get("entity", None)
+            if e is None or self.world.entities.get(e.eid, None) is not e:
+                return None
+            slot = e.__metadata__.exact_indices.get(type(obj), -1)
+            if slot == -1 or e._archetype.columns[slot][e._row] is not obj:
+                return None
+            return ("c", e.eid, slot)
+        if kind == "e":
+            if self.world.entities.get(obj.eid, None) is obj:
+                return ("e", obj.eid)
+            return None
+        if kind == "cell":
+            m = self.ref(obj.map)
+            if m is None:
+                return None
+            return ("cell", m[1], m[2], obj.y, obj.x)
+        if kind == "w":
+            return ("w",) if obj is self.world else None
+        oid = self.oids.get(obj, None)
+        if oid is None:
+            oid = self.oids[obj] = next(self.counter)
+            self.pending.append(obj)
+        return ("o", oid, type(obj))
+
+    def dumps(self, value: typing.Any) -> bytes:
+        return serializer.dumps(value, self.ref)
+
+    def encode(
+        self,
+        spawned: list[tuple[str, typing.Any]],
+        components: typing.Iterable[tuple[PersistentId, Component]],
+        cells: typing.Iterable[tuple[PersistentId, MapCell]],
+        objects: typing.Iterable[typing.Any],
+        world: bool = True,
+    ) -> bytes:
+        # components and cells come with their references
+        journal: list[tuple] = []
+        entity_states: list[tuple[int, dict[str, typing.Any]]] = []
+        for op, arg in spawned:
+            if op == "spawn":
+                journal.append((op, type(arg), arg.eid))
+                entity_states.append((arg.eid, state_of(arg)))
+            else:
+                journal.append((op, arg))
+
+        component_states = [(ref, state_of(c)) for ref, c in components]
+        cell_states = [(ref, state_of(cell)) for ref, cell in cells]
+
+        self.pending.extend(o for o in objects if o in self.oids)
+        random_state = self.dumps(self.world.random)
+        world_state = b""
+        if world:
+            state = dict(state_of(self.world))
+            del state["random"]
+            world_state = self.dumps(state)
+        parts = {
+            "journal": journal,
+            "entities": self.dumps(entity_states),
+            "components": self.dumps(component_states),
+            "cells": self.dumps(cell_states),
+            "world": world_state,
+            "ticks": (self.world.tick, self.world._timers.tick),
+            "random": b"" if random_state == self.random_state else random_state,
+            "objects": [],
+        }
+        seen: set[int] = set()
+        while self.pending:
+            batch = [o for o in self.pending if id(o) not in seen]
+            self.pending.clear()
+            seen.update(map(id, batch))
+            states = [(self.ref(o), state_of(o)) for o in batch]
+            parts["objects"].append(self.dumps(states))
+        self.random_state = random_state
+        return serializer.dumps(parts)
+
+
+## Reading
+
+
+class _Decoder:
+    def __init__(self, world: World):
+        self.world = world
+        self.objects: dict[int, typing.Any] = {}
+        self.fresh: dict[typing.Any, None] = {}
+        self.cells: dict[PersistentId, MapCell] = {}
+
+    def resolve(self, pid: PersistentId) -> typing.Any:
+        kind = pid[0]
+        if kind == "c":
+            e = self.world.entities[pid[1]]
+            column = e._archetype.columns[pid[2]]
+            o = column[e._row]
+            if o is None:
+                t = e.__metadata__.types[pid[2]]
+                o = column[e._row] = t.__new__(t)
+                o.entity = e
+                self.fresh[o] = None
+            return o
+        if kind == "e":
+            return self.world.entities[pid[1]]
+        if kind == "cell":
+            cell = self.cells.get(pid, None)
+            if cell is None:
+                m: Map = self.resolve(("c", pid[1], pid[2]))
+                if m not in self.fresh:
+                    cell = m._peek(pid[3], pid[4])
+                if cell is None:
+                    cell = MapCell(pid[3], pid[4], m)
+                self.cells[pid] = cell
+            return cell
+        if kind == "w":
+            return self.world
+        if kind == "o":
+            o = self.objects.get(pid[1], None)
+            if o is None:
+                o = self.objects[pid[1]] = pid[2].__new__(pid[2])
+            return o
+        raise ValueError(f"unknown reference {pid!r}")
+
+    def loads(self, data: bytes) -> typing.Any:
+        return serializer.loads(data, self.resolve)
+
+    def apply(self, record: bytes):
+        world = self.world
+        parts = serializer.loads(record)
+        for op, *args in parts["journal"]:
+            if op == "spawn":
+                t, eid = args
+                world.spawn(t.__new__(t), eid)
+            else:
+                world.despawn(world.entities[args[0]])
+        for eid, state in self.loads(parts["entities"]):
+            e = world.entities.get(eid, None)
+            if e is not None:
+                e.__dict__.update(state)
+        for data in parts["objects"]:
+            for ref, state in self.loads(data):
+                self.resolve(ref).__dict__.update(state)
+        for ref, state in self.loads(parts["components"]):
+            self.resolve(ref).__dict__.update(state)
+        for ref, state in self.loads(parts["cells"]):
+            self.resolve(ref).__dict__.update(state)
+        if parts["world"]:
+            world.__dict__.update(self.loads(parts["world"]))
+        world.tick, world._timers.tick = parts["ticks"]
+        if parts["random"]:
+            world.random = self.loads(parts["random"])
+
+        for o in self.fresh:
+            reset = getattr(o, "_reset_transient", None)
+            if reset is not None:
+                reset()
+        self.fresh.clear()
+        for cell in self.cells.values():
+            cell.map._adopt(cell)
+        self.cells.clear()
+
+
+## Files
+
+
+class SnapshotWriter:
+    def __init__(self, world: World, path: str, compact_ratio: float = 1.0, fsync: bool = False):
+        self.world = world
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.fsync = fsync
+        self.base_size = 0
+        self.delta_size = 0
+        self._oids: weakref.WeakKeyDictionary[typing.Any, int] = weakref.WeakKeyDictionary()
+        self._counter = itertools.count()
+        self._random_state = b""
+        world.dirty = set()
+        world.journal = []
+        self.write_base()
+
+    def autosave(self):
+        self.world.judged += self.write_delta
+
+    def close(self):
+        self.world.judged -= self.write_delta
+        self.world.dirty = None
+        self.world.journal = None
+
+    def _reset(self):
+        assert self.world.dirty is not None and self.world.journal is not None
+        self.world.dirty.clear()
+        self.world.journal.clear()
+
+    def write_base(self):
+        self._oids = weakref.WeakKeyDictionary()
+        self._counter = itertools.count()
+        encoder = _Encoder(self.world, self._oids, self._counter)
+        data = _base_record(self.world, encoder)
+        self._random_state = encoder.random_state
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            _write_record(f, BASE, data, self.fsync)
+        os.replace(tmp, self.path)
+        self.base_size = len(data)
+        self.delta_size = 0
+        self._reset()
+
+    def write_delta(self):
+        world = self.world
+        dirty = world.dirty
+        assert dirty is not None and world.journal is not None
+        encoder = _Encoder(world, self._oids, self._counter)
+        encoder.random_state = self._random_state
+        refs = [(encoder.ref(o), o) for o in dirty if isinstance(o, (Component, MapCell))]
+        data = encoder.encode(
+            world.journal,
+            [(ref, o) for ref, o in refs if ref is not None and ref[0] == "c"],
+            [(ref, o) for ref, o in refs if ref is not None and ref[0] == "cell"],
+            [o for o in dirty if isinstance(o, persistent_types)],
+            world in dirty,
+        )
+        self._random_state = encoder.random_state
+        with open(self.path, "ab") as f:
+            _write_record(f, DELTA, data, self.fsync)
+        self.delta_size += len(data)
+        self._reset()
+        if self.delta_size > self.base_size * self.compact_ratio:
+            self.write_base()
+
+
+def _base_record(world: World, encoder: _Encoder) -> bytes:
+    entities = [e for arch in world.archetypes.values() for e in arch.entities]
+    components = [
+        (("c", e.eid, slot), c)
+        for arch in world.archetypes.values()
+        for slot, column in enumerate(arch.columns)
+        for e, c in zip(arch.entities, column)
+        if c is not None
+    ]
+    cells = [
+        (("cell", ref[1], ref[2], cell.y, cell.x), cell)
+        for ref, m in components
+        if isinstance(m, Map)
+        for cell in m.cells()
+    ]
+    return encoder.encode([("spawn", e) for e in entities], components, cells, ())
+
+
+def dumps(world: World) -> bytes:
+    return _base_record(world, _Encoder(world, weakref.WeakKeyDictionary(), itertools.count()))
+
+
+def loads(data: bytes, world: World | None = None) -> World:
+    world = world or World()
+    _Decoder(world).apply(data)
+    return world
+
+
+def _write_record(f: typing.IO[bytes], kind: bytes, data: bytes, fsync: bool):
+    f.write(_RECORD.pack(kind, len(data)))
+    f.write(data)
+    f.flush()
+    if fsync:
+        os.fsync(f.fileno())
+
+
+def read_records(path: str) -> typing.Iterator[tuple[bytes, bytes]]:
+    with open(path, "rb") as f:
+        while header := f.read(_RECORD.size):
+            kind, size = _RECORD.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                # a delta cut short by a crash; everything before it is intact
+                return
+            yield kind, data
+
+
+def load(path: str, world: World | None = None) -> World:
+    world = world or World()
+    decoder = _Decoder(world)
+    for i, (kind, data) in enumerate(read_records(path)):
+        if (i == 0) != (kind == BASE):
+            raise ValueError(f"{path} is not a snapshot file")
+        decoder.apply(data)
+    return world
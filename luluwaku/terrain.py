@@ -0,0 +1,350 @@
+from __future__ import annotations
+import array
+import ast
+import mmap
+import os
+import struct
+import sys
+import typing
+
+# Terrain data is kept in typed layers instead of on MapCell objects: one
+# array.array per CHUNK x CHUNK chunk, row-major, allocated the first time a
+# value in the chunk differs from the layer default. Writes bump `version`
+# and track the written chunks in the world of the owner (the Map), so
+# caches are invalidated and snapshot deltas only carry those chunks.
+#
+# A layer can also be backed by a map file (see `write_map_file`): chunks
+# that are not in memory are then faulted in from the memory-mapped file on
+# first access, and unmodified ones can be released again.
+
+
+class Tracker(typing.Protocol):
+    def track(self, o: typing.Any) -> None:
+        ...
+
+
+class Owner(typing.Protocol):
+    @property
+    def world(self) -> Tracker:
+        ...
+
+
+class TerrainChunk:
+    def __init__(self, values: array.array):
+        self.values = values
+
+
+class TerrainLayer:
+    __transient__ = ("_source", "_faulted", "_versions")
+    # the map file backing this layer and the index of the layer in it
+    path: str | None = None
+    index: int = 0
+    _source: MapFile | None = None
+    _faulted: set[int] | None = None
+    _versions: dict[int, int] | None = None
+
+    def __init__(
+        self,
+        owner: Owner,
+        row: int,
+        col: int,
+        typecode: str,
+        default: int | float,
+        chunk: int = 32,
+    ):
+        self.owner = owner
+        self.row = row
+        self.col = col
+        self.typecode = typecode
+        self.default = default
+        self.chunk = chunk
+        self.version = 0
+        self.chunks: dict[int, TerrainChunk] = {}
+
+    def _chunk_of(self, x: int, y: int) -> int:
+        C = self.chunk
+        return (y // C) * (self.col // C + 1) + x // C
+
+    def _changed(self, cid: int, chunk: TerrainChunk):
+        self.version += 1
+        if self._versions is None:
+            self._versions = {}
+        self._versions[cid] = self._versions.get(cid, 0) + 1
+        if self._faulted:
+            self._faulted.discard(cid)
+        self.owner.world.track(chunk)
+
+    def chunk_versions(self, x0: int, y0: int, x1: int, y1: int) -> tuple[int, ...]:
+        # write counters of the chunks covering a region, for caches that
+        # only depend on that region
+        versions = self._versions
+        if not versions:
+            return ()
+        C = self.chunk
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.col - 1), min(y1, self.row - 1)
+        return tuple(
+            versions.get(self._chunk_of(cx * C, cy * C), 0)
+            for cy in range(y0 // C, y1 // C + 1)
+            for cx in range(x0 // C, x1 // C + 1)
+        )
+
+    def __getstate__(self):
+        return {**self.__dict__, "_source": None}
+
+    def _lookup(self, cid: int) -> TerrainChunk | None:
+        chunk = self.chunks.get(cid, None)
+        if chunk is None and self.path is not None:
+            chunk = self._fault(cid)
+        return chunk
+
+    def _fault(self, cid: int) -> TerrainChunk | None:
+        source = self._source
+        if source is None or source.closed:
+            assert self.path is not None
+            source = self._source = MapFile.open(self.path)
+        data = source.read_chunk(self.index, cid)
+        if data is None:
+            return None
+        values = array.array(self.typecode)
+        values.frombytes(data)
+        chunk = self.chunks[cid] = TerrainChunk(values)
+        if self._faulted is None:
+            self._faulted = set()
+        self._faulted.add(cid)
+        return chunk
+
+    def release(self, keep: typing.Container[int] = ()) -> int:
+        # drop the chunks faulted in from the map file and not written since
+        faulted = self._faulted
+        if not faulted:
+            return 0
+        released = [cid for cid in faulted if cid not in keep]
+        for cid in released:
+            del self.chunks[cid]
+            faulted.discard(cid)
+        return len(released)
+
+    def close(self):
+        # unmap the backing file; chunks are faulted from a fresh map later
+        if self._source is not None:
+            self._source = None
+            MapFile.close_path(self.path)
+
+    def get(self, x: int, y: int) -> typing.Any:
+        if not (0 <= y < self.row and 0 <= x < self.col):
+            raise IndexError((x, y))
+        chunk = self.chunks.get(self._chunk_of(x, y), None)
+        if chunk is None:
+            if self.path is None:
+                return self.default
+            chunk = self._fault(self._chunk_of(x, y))
+            if chunk is None:
+                return self.default
+        C = self.chunk
+        return chunk.values[(y % C) * C + x % C]
+
+    def set(self, x: int, y: int, value: typing.Any):
+        if not (0 <= y < self.row and 0 <= x < self.col):
+            raise IndexError((x, y))
+        cid = self._chunk_of(x, y)
+        if self._lookup(cid) is None and value == self.default:
+            return
+        chunk = self._chunk(cid)
+        C = self.chunk
+        chunk.values[(y % C) * C + x % C] = value
+        self._changed(cid, chunk)
+
+    def _segments(
+        self, x: int, y: int, width: int, height: int
+    ) -> typing.Iterator[tuple[int, int, int, int]]:
+        # (chunk id, offset in chunk, length, offset in the region) of every
+        # row piece of the region clipped to the layer, one chunk at a time
+        C = self.chunk
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.col), min(y + height, self.row)
+        for cy in range(y0, y1):
+            cx = x0
+            while cx < x1:
+                n = min(x1, (cx // C + 1) * C) - cx
+                yield self._chunk_of(cx, cy), (cy % C) * C + cx % C, n, (cy - y) * width + cx - x
+                cx += n
+
+    def _chunk(self, cid: int) -> TerrainChunk:
+        chunk = self._lookup(cid)
+        if chunk is None:
+            C = self.chunk
+            values = array.array(self.typecode, [self.default]) * (C * C)
+            chunk = self.chunks[cid] = TerrainChunk(values)
+            self.owner.world.track(self)
+        return chunk
+
+    def fill(self, x: int, y: int, width: int, height: int, value: typing.Any):
+        one = array.array(self.typecode, [value])
+        for cid, offset, n, _ in self._segments(x, y, width, height):
+            if value == self.default and self._lookup(cid) is None:
+                continue
+            chunk = self._chunk(cid)
+            chunk.values[offset : offset + n] = one * n
+            self._changed(cid, chunk)
+
+    def blit(self, x: int, y: int, width: int, values: typing.Sequence[typing.Any]):
+        # `values` is a row-major block `width` cells wide
+        if not isinstance(values, array.array) or values.typecode != self.typecode:
+            values = array.array(self.typecode, values)
+        height = len(values) // width
+        for cid, offset, n, src in self._segments(x, y, width, height):
+            chunk = self._chunk(cid)
+            chunk.values[offset : offset + n] = values[src : src + n]
+            self._changed(cid, chunk)
+
+    def read(self, x: int, y: int, width: int, height: int) -> array.array:
+        # a row-major copy of a region, the default outside the layer
+        out = array.array(self.typecode, [self.default]) * (width * height)
+        for cid, offset, n, dst in self._segments(x, y, width, height):
+            chunk = self._lookup(cid)
+            if chunk is not None:
+                out[dst : dst + n] = chunk.values[offset : offset + n]
+        return out
+
+    def load(self, path: str, x: int = 0, y: int = 0):
+        (height, width), values = read_npy(path)
+        if values.typecode != self.typecode:
+            values = array.array(self.typecode, values)
+        self.blit(x, y, width, values)
+
+
+## Map files
+
+# header, then per layer its name, typecode, default and the offset of its
+# chunk table; a table holds the file offset of every chunk (0 for chunks
+# left at the default) and is followed by the raw chunk data
+_MAGIC = b"LWMAP\x01"
+_HEADER = struct.Struct("<6sIIHH")
+_LAYER = struct.Struct("<H1sdQ")
+
+
+class MapFile:
+    _open: dict[str, MapFile] = {}
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.row, self.col, self.chunk, count = _HEADER.unpack_from(self.mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a map file")
+        C = self.chunk
+        self.chunk_count = (self.row // C + 1) * (self.col // C + 1)
+        self.layers: list[tuple[str, str, float, memoryview]] = []
+        pos = _HEADER.size
+        for _ in range(count):
+            size, typecode, default, table = _LAYER.unpack_from(self.mm, pos)
+            pos += _LAYER.size
+            name = bytes(self.mm[pos : pos + size]).decode()
+            pos += size
+            offsets = memoryview(self.mm)[table : table + 8 * self.chunk_count].cast("Q")
+            self.layers.append((name, typecode.decode(), default, offsets))
+
+    @classmethod
+    def open(cls, path: str) -> MapFile:
+        f = cls._open.get(path, None)
+        if f is None:
+            f = cls._open[path] = MapFile(path)
+        return f
+
+    @classmethod
+    def close_path(cls, path: str):
+        f = cls._open.pop(path, None)
+        if f is not None:
+            f.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.mm.closed
+
+    def close(self):
+        # the chunk tables are views of the mapping and must go first
+        for _, _, _, offsets in self.layers:
+            offsets.release()
+        self.mm.close()
+
+    def read_chunk(self, layer: int, cid: int) -> bytes | None:
+        _, typecode, _, offsets = self.layers[layer]
+        offset = offsets[cid]
+        if offset == 0:
+            return None
+        size = self.chunk * self.chunk * array.array(typecode).itemsize
+        return self.mm[offset : offset + size]
+
+
+def write_map_file(
+    path: str, row: int, col: int, chunk: int, layers: dict[str, TerrainLayer]
+):
+    count = (row // chunk + 1) * (col // chunk + 1)
+    names = [name.encode() for name in layers]
+    pos = _HEADER.size + sum(_LAYER.size + len(name) for name in names)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, row, col, chunk, len(layers)))
+        blocks = []
+        for name, layer in zip(names, layers.values()):
+            offsets = array.array("Q", [0]) * count
+            data = bytearray()
+            table = pos
+            pos += 8 * count
+            for cid in range(count):
+                c = layer._lookup(cid)
+                if c is not None:
+                    offsets[cid] = pos + len(data)
+                    data += c.values.tobytes()
+            pos += len(data)
+            f.write(
+                _LAYER.pack(len(name), layer.typecode.encode(), layer.default, table)
+            )
+            f.write(name)
+            blocks.append(offsets.tobytes() + data)
+        for block in blocks:
+            f.write(block)
+    MapFile.close_path(path)
+    os.replace(tmp, path)
+
+
+## .npy files
+
+_NPY_MAGIC = b"\x93NUMPY"
+
+_NPY_TYPECODES = {
+    "b1": "B",
+    "u1": "B",
+    "i1": "b",
+    "u2": "H",
+    "i2": "h",
+    "u4": "I",
+    "i4": "i",
+    "u8": "Q",
+    "i8": "q",
+    "f4": "f",
+    "f8": "d",
+}
+
+
+def read_npy(path: str) -> tuple[tuple[int, int], array.array]:
+    # 2-D arrays in C order, as written by numpy.save
+    with open(path, "rb") as f:
+        if f.read(6) != _NPY_MAGIC:
+            raise ValueError(f"{path} is not a .npy file")
+        major, _ = f.read(2)
+        (size,) = struct.unpack("<H" if major == 1 else "<I", f.read(2 if major == 1 else 4))
+        header = ast.literal_eval(f.read(size).decode("latin1"))
+        descr: str = header["descr"]
+        if header["fortran_order"] or len(header["shape"]) != 2:
+            raise ValueError(f"{path}: only 2-D arrays in C order are supported")
+        typecode = _NPY_TYPECODES.get(descr[1:], None)
+        if typecode is None:
+            raise ValueError(f"{path}: unsupported dtype {descr}")
+        values = array.array(typecode)
+        values.frombytes(f.read())
+    swap = descr[0] == (">" if sys.byteorder == "little" else "<")
+    if swap and values.itemsize > 1:
+        values.byteswap()
+    return header["shape"], values
@@ -0,0 +1,119 @@
+import os
+from luluwaku.core import *
+from luluwaku import snapshot
+
+
+class Soldier(Entity):
+    __components__ = (Unit, TableBoard)
+
+
+def test_table_board():
+    world = World()
+    soldiers = [Soldier(world) for _ in range(3)]
+    boards = [s[Board] for s in soldiers]
+    assert all(type(b) is TableBoard for b in boards)
+    table = world.board_table()
+    assert [b._row for b in boards] == [0, 1, 2]
+
+    for b in boards:
+        b.apply_CON(10)
+        b.apply_SPR(10)
+        b.apply_HP(b.MAX_HP)
+    assert boards[0].MAX_EFFORTS == 20 and boards[0].MP == 0
+    assert table.column("MAX_HP").tolist() == [10.0] * 3
+
+    assert boards[0].consume_efforts(9) and boards[1].consume_efforts(4)
+    table.restore_efforts()
+    assert [b.EFFORTS for b in boards] == [20, 20, 20]
+
+    deaths = []
+    listener = lambda: deaths.append(2)
+    boards[2].on_death += listener
+    boards[2].apply_HP(3)
+    table.regen(hp=-4, mp=2)
+    assert [b.HP for b in boards] == [6, 6, 0]
+    assert [b.MP for b in boards] == [2, 2, 0]
+    assert deaths == [2] and not boards[2].alive
+    boards[2].on_death -= listener
+    table.restore_efforts()
+    boards[2].apply_HP(5)
+    assert boards[2].HP == 0
+
+    world.despawn(soldiers[0])
+    assert table.free == [0]
+    assert Soldier(world)[Board]._row == 0
+
+    loaded = snapshot.loads(snapshot.dumps(world))
+    assert sorted((b.HP, b.alive) for b, in loaded.query(Board)) == [
+        (0, False),
+        (0, True),
+        (6, True),
+    ]
+    assert loaded.boards is not None and loaded.boards.free == []
+
+
+def test_table_board_delta(tmp_path):
+    path = os.path.join(tmp_path, "save")
+    world = World()
+    boards = [Soldier(world)[Board] for _ in range(8 * BoardTable.CHUNK)]
+    for b in boards:
+        b.apply_CON(10)
+        b.apply_HP(10)
+    writer = snapshot.SnapshotWriter(world, path, compact_ratio=100)
+    boards[-1].apply_HP(4)
+    writer.write_delta()
+    # only the chunk of the board is written
+    assert writer.delta_size * 5 < writer.base_size
+    world.board_table().restore_efforts()
+    writer.write_delta()
+
+    loaded = snapshot.load(path)
+    hps = [b.HP for b, in loaded.query(Board)]
+    assert hps == [10.0] * (len(boards) - 1) + [4.0]
+    assert loaded.board_table().column("HP").tolist() == hps
+    writer.close()
+
+
+class Knight(Entity):
+    __components__ = (Unit, Board)
+
+
+def test_modifiers():
+    from luluwaku.items.weapons.normal_sword import NormalSword
+
+    world = World()
+    for board in (Knight(world)[Board], Soldier(world)[Board]):
+        board.apply_STR(5)
+        board.apply_CON(10)
+        board.apply_HP(10)
+        sword = NormalSword(3)
+        for _ in range(100):
+            sword.on_equipped(board.entity[Unit])
+            sword.on_unequipped(board.entity[Unit])
+        assert board.STR == 5 and board.modifiers == {}
+
+        sword.on_equipped(board.entity[Unit])
+        board.apply_STR(6)
+        assert board.STR == 6 + 2 + 0.9 * 3
+
+        buff = object()
+        board.add_modifier(Modifier("CON", percent=-0.5, source=buff))
+        board.add_modifier(Modifier("MAX_HP", flat=1, source=buff))
+        # derived stats are only computed when read, or when their pool is
+        assert "MAX_HP" in board._dirty
+        assert board.HP == 6 and "MAX_HP" not in board._dirty
+        assert board.MAX_HP == 6
+        assert board.MAX_EFFORTS == 13 and "MAX_EFFORTS" not in board._dirty
+        assert len(board.remove_modifiers(buff)) == 2
+        assert board.CON == 10 and board.MAX_HP == 10 and board.HP == 6
+
+        # fractional derived stats are kept
+        board.apply_CON(10.7)
+        board.apply_SPR(5)
+        assert board.MAX_HP == 10.7 and board.MAX_MP == 2.5
+
+        # lowering an input clamps the pool before it is read
+        board.apply_CON(100)
+        board.apply_HP(100)
+        board.apply_CON(50)
+        assert board.HP == 50 and board.MAX_HP == 50
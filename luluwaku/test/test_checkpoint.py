@@ -0,0 +1,33 @@
+import os
+from luluwaku.core import *
+from luluwaku import snapshot
+from luluwaku.checkpoint import Checkpointer
+
+
+class Player(Entity):
+    __components__ = (Unit, Board)
+
+
+def test_checkpoint(tmp_path):
+    path = os.path.join(tmp_path, "save")
+    world = World(seed=1)
+    Player(world)[Unit].uname = "a"
+    logs = []
+    world.add_logger(lambda msg, unames, public: logs.append(msg))
+    reports = []
+
+    checkpointer = Checkpointer(world, path, max_children=1, report=reports.append)
+    checkpointer.attach()
+    world.judge()
+    # the child of tick 1 is still running or not reaped yet
+    world.judge()
+    checkpointer.wait()
+    checkpointer.detach()
+
+    saved = snapshot.load(path)
+    assert saved.tick == checkpointer.saved_tick
+    assert [u.uname for u, in saved.query(Unit)] == ["a"]
+    assert f"checkpoint of tick {saved.tick} saved to {path}" in reports
+    # players never see checkpoint messages
+    assert logs == []
+    assert os.listdir(tmp_path) == ["save"]
@@ -0,0 +1,266 @@
+import random
+from luluwaku.core import *
+from luluwaku.actions import transaction, group
+
+
+class Trader(Entity):
+    __components__ = (Unit, Board, Bag)
+
+    def __init__(self, world: World, uname: str, money: int):
+        Entity.__init__(self, world)
+        self[Unit].uname = uname
+        self[Bag].add_money(money)
+
+
+def make_data(money: int) -> transaction.Data:
+    data = transaction.Data()
+    data.money = money
+    data.items = set()
+    return data
+
+
+def test_transaction_lookup():
+    world = World()
+    a = Trader(world, "a", 10)[Unit]
+    b = Trader(world, "b", 10)[Unit]
+    create = transaction.Create(a, b, make_data(3), make_data(0))
+    create.submit(world)
+    assert world.find_effect(transaction.Create, create.ticket_id) is create
+    assert create in world.effects_of(transaction.Create)
+
+    transaction.ModMoney(a, create.ticket_id, 4).submit(world)
+    transaction.Shake(a, create.ticket_id).submit(world)
+    transaction.Shake(b, create.ticket_id).submit(world)
+    world.judge()
+    assert create.cost.money == 4
+    world.judge()
+
+    assert a[Bag].money == 6
+    assert b[Bag].money == 14
+    assert world.find_effect(transaction.Create, create.ticket_id) is None
+
+
+def test_join_lookup():
+    world = World()
+    owner = Trader(world, "owner", 0)[Unit]
+    member = Trader(world, "member", 0)[Unit]
+    Group(owner, "g")
+
+    join = group.Join(member, "g")
+    join.submit(world)
+    assert world.find_effect(group.Join, ("g", "member")) is join
+
+    group.ResponseJoin(owner, "g", "member", True).submit(world)
+    world.judge()
+    world.judge()
+    assert member.group is owner.group
+
+
+def test_parked_effects():
+    world = World()
+    steps = []
+
+    class Waiter(Effect):
+        def on_step(self) -> bool:
+            steps.append("waiter")
+            if len(steps) == 1:
+                return self.wait("go")
+            return False
+
+    class Sleeper(Effect):
+        def on_step(self) -> bool:
+            steps.append(("sleeper", world.tick))
+            if len(steps) == 1:
+                return self.sleep(3)
+            return False
+
+    Waiter().submit(world)
+    for _ in range(5):
+        world.judge()
+    assert steps == ["waiter"]
+    world.signal("go")
+    world.judge()
+    assert steps == ["waiter", "waiter"]
+
+    steps.clear()
+    start = world.tick
+    Sleeper().submit(world)
+    for _ in range(5):
+        world.judge()
+    assert steps == [("sleeper", start), ("sleeper", start + 3)]
+
+
+def test_timing_wheel():
+    class Wheel(TimingWheel):
+        LEVELS = 2
+
+    rng = random.Random(1)
+    wheel = Wheel()
+    ticks = [rng.randrange(10000) for _ in range(500)] + [0, 63, 64, 4095, 4096]
+    for n, tick in enumerate(ticks):
+        wheel.add(tick, n)
+    assert len(wheel) == len(ticks)
+    seen = []
+    for tick in range(0, 10000, 7):
+        due = wheel.advance(tick)
+        assert all(n == -1 or ticks[n] <= tick for n in due)
+        seen.extend(n for n in due if n != -1)
+        # ticks already passed are due on the next one
+        wheel.add(tick - 1, -1)
+        assert wheel.advance(tick) == [] and wheel.tick == tick + 1
+    assert [ticks[n] for n in seen] == sorted(ticks) and wheel.advance(10000) == [-1]
+
+
+def test_buffs():
+    world = World()
+    unit = Trader(world, "a", 0)[Unit]
+    board = unit[Board]
+    board.apply_STR(10)
+
+    class Rage(Buff):
+        duration = 3
+        max_stacks = 2
+
+        def modifiers(self):
+            return [Modifier("STR", flat=1, percent=0.5)]
+
+    class Slow(Buff):
+        duration = 2
+        stacking = Buff.EXTEND
+
+    rage = world.add_buff(unit, Rage())
+    assert board.buffs == {rage} and board.STR == 16.5
+    world.judge()
+    assert world.add_buff(unit, Rage()) is rage
+    assert rage.stacks == 2 and rage.expires == 4 and board.STR == 24
+    # no more stacks, the duration is still refreshed
+    world.add_buff(unit, Rage())
+    assert board.STR == 24 and rage.expires == 4
+
+    slow = world.add_buff(unit, Slow())
+    world.add_buff(unit, Slow())
+    assert slow.expires == 5
+    for tick in range(1, 6):
+        world.judge()
+        assert (rage in board.buffs, slow in board.buffs) == (tick < 4, tick < 5)
+    assert board.STR == 10 and board.modifiers == {} and rage.target is None
+
+    lasting = world.add_buff(unit, Slow())
+    world.remove_buff(lasting)
+    assert board.buffs == set() and len(world._timers) == 1
+    for _ in range(3):
+        world.judge()
+    assert len(world._timers) == 0
+
+    # an aura refreshed every tick keeps a single wheel entry
+    class Aura(Buff):
+        duration = 50
+
+    aura = world.add_buff(unit, Aura())
+    for _ in range(100):
+        assert world.add_buff(unit, Aura()) is aura
+        world.judge()
+    assert len(world._timers) == 1
+    for _ in range(51):
+        world.judge()
+    assert aura.target is None and len(world._timers) == 0
+
+    class Bleed(Buff):
+        duration = 5
+        stacking = Buff.INDEPENDENT
+        max_stacks = 2
+
+    first = world.add_buff(unit, Bleed())
+    world.judge()
+    second = world.add_buff(unit, Bleed())
+    third = world.add_buff(unit, Bleed())
+    assert board.buffs == {second, third} and first.target is None
+
+
+class Fighter(Entity):
+    __components__ = (Unit, Board, Positional, DamanageAccepter, Dodger)
+
+    def __init__(self, world: World, m: Map, uname: str, x: int):
+        Entity.__init__(self, world)
+        self[Unit].uname = uname
+        Group(self[Unit], uname)
+        Positional(m, self[Unit]).set_pos(x, 0)
+        board = self[Board]
+        board.apply_CON(100)
+        board.apply_HP(100)
+        board.apply_SPR(x)
+        board.apply_DEX(50)
+        self[Dodger], self[DamanageAccepter]
+
+
+class Land(Entity):
+    __components__ = (Map,)
+
+
+def test_attacks():
+    from luluwaku.actions.attack import NormalAttack
+
+    def battle(seed: int, batched: bool) -> list[float]:
+        world = World(seed)
+        m = Map(10, 10, "m", Land(world))
+        units = [Fighter(world, m, str(x), x)[Unit] for x in range(4)]
+        units[1][DamanageAccepter].add_shield(Shield(3))
+        make = lambda: Damage(focus=5, physical_damage=2, real_damage=1)
+        for _ in range(5):
+            for a in units:
+                for t in units:
+                    if a is t:
+                        continue
+                    if batched:
+                        world.intend_attack(a, t, make())
+                    elif not t[Dodger].dodge(a, damage := make()):
+                        t[DamanageAccepter].on_damage(a, damage)
+            world.judge()
+        return [u[Board].HP for u in units]
+
+    for seed in range(5):
+        assert battle(seed, True) == battle(seed, False)
+    assert len({tuple(battle(seed, True)) for seed in range(5)}) > 1
+
+    world = World(0)
+    m = Map(10, 10, "m", Land(world))
+    a, b = (Fighter(world, m, str(x), x)[Unit] for x in (1, 2))
+    NormalAttack(a, b).submit(world)
+    world.judge()
+    assert world._attacks == [] and b[Board].HP < 100
+
+    # HP is applied per damage term: a killing hit is not undone by a
+    # negative real damage (this focus always crits and is never dodged)
+    hp = b[Board].HP
+    world.intend_attack(a, b, Damage(focus=100, physical_damage=hp / 2, real_damage=-5))
+    world.judge()
+    assert b[Board].HP == 0 and not b[Board].alive
+
+
+def test_shield_pool():
+    pool = ShieldPool()
+    low, high, timed = Shield(5), Shield(3, priority=1), Shield(4, expires=2)
+    for shield in (low, high, timed):
+        pool.add(shield)
+    assert list(pool) == [high, low, timed] and pool.total == 12
+    assert pool.absorb(4, 0) == 0 and (high.value, low.value) == (0, 4)
+    assert len(pool) == 2 and pool.capacity(1) == 8
+    # the timed shield is gone at its expiry tick
+    assert pool.capacity(2) == 4 and len(pool) == 1
+    assert pool.absorb(6, 2) == 2 and pool.total == 0 and len(pool) == 0
+
+    for n in range(1000):
+        pool.add(Shield(0.1, expires=n))
+        pool.absorb(0.05, n)
+    assert len(pool._heap) + len(pool._expiry) <= 4
+    assert pool.capacity(1000) == 0
+
+
+def test_shield_pool_depleted_timed_shields():
+    pool = ShieldPool()
+    pool.add(Shield(5, priority=-1))
+    for n in range(10000):
+        pool.add(Shield(1, expires=10**9))
+        assert pool.absorb(1, n) == 0
+    assert len(pool._heap) == 1 and len(pool._expiry) <= 2
+    assert pool.total == 5
@@ -1,8 +1,23 @@
+import math
 import typing
+import pytest
 from luluwaku.core import *
 from pprint import pprint
 
 
+class Land(Entity):
+    __components__ = (Map,)
+
+
+class Walker(Entity):
+    __components__ = (Unit, Board, Positional)
+
+    def __init__(self, world: World, m: Map | None = None, x: int = 0, y: int = 0):
+        Entity.__init__(self, world)
+        if m is not None:
+            Positional(m, self[Unit]).set_pos(x, y)
+
+
 def test_maps():
     class MapObject(Entity):
         __components__ = (Map,)
@@ -48,3 +63,411 @@ def test_maps():
         (user, "enter", m.find_cell_at_point(2, 4)),
         (user, "leave", m.find_cell_at_point(2, 4)),
     ]
+
+
+def test_spatial_index():
+    world = World()
+    m = Map(60, 80, "m", Land(world))
+    points = [(0, 0), (3, 4), (5, 5), (20, 20), (79, 59), (40, 10)]
+    units = [Walker(world, m, x, y)[Unit] for x, y in points]
+
+    def brute(x, y, r):
+        return {u for u, (ux, uy) in zip(units, points) if (ux - x) ** 2 + (uy - y) ** 2 <= r * r}
+
+    assert set(m.units_in_radius(0, 0, 5)) == brute(0, 0, 5) == set(units[:2])
+    assert set(m.units_in_radius(30, 15, 20)) == brute(30, 15, 20)
+    assert set(m.units_in_rect(3, 4, 40, 20)) == {units[1], units[2], units[3], units[5]}
+    assert m.nearest_units(4, 4, 2) == [units[1], units[2]]
+    assert m.nearest_units(78, 58, 1) == [units[4]]
+    assert m.nearest_units(78, 58, 10, radius=30) == [units[4]]
+    assert len(m.nearest_units(0, 0, 10)) == len(units)
+
+    units[1].entity[Positional].set_pos(70, 50)
+    assert set(m.units_in_radius(0, 0, 5)) == {units[0]}
+    assert m.nearest_units(78, 58, 2) == [units[4], units[1]]
+    # not a single empty cell is materialized by the queries
+    assert sum(1 for _ in m.cells()) == len(points) + 1
+
+
+def test_sparse_cells():
+    world = World()
+    m = Map(4000, 3000, "m", Land(world))
+    assert m.find_cell_at_point(2999, 3999) is not None
+    assert m.find_cell_at_point(3000, 0) is None
+    assert sum(1 for _ in m.find_cells_within_circle(100, 100, 10)) > 0
+    assert list(m.cells()) == []
+
+    cell = m.find_cell_at_point(2999, 10)
+    assert m.find_cell_at_point(2999, 10) is cell
+    assert (cell.x, cell.y) == (2999, 10)
+    # terrain lives in the layers, listeners make a cell stored
+    cell.pass_consumption = 3
+    assert list(m.cells()) == [] and cell.pass_consumption == 3
+    cell.register_enter_events(lambda *_: None)
+    assert list(m.cells()) == [cell]
+
+    walker = Walker(world)
+    pos = Positional(m, walker[Unit])
+    pos.set_pos(5, 3999)
+    assert pos.loc() is m.find_cell_at_point(5, 3999)
+    assert len(list(m.cells())) == 2
+    pos.set_pos(6, 3999)
+    assert m.evict_idle() == 1
+    assert set(m.cells()) == {cell, pos.loc()}
+    assert m.find_cell_at_point(5, 3999) is not None
+
+
+def test_paths():
+    world = World()
+    m = Map(10, 10, "m", Land(world))
+    # an expensive wall on x == 5 with a gap at y == 8
+    for y in range(10):
+        if y != 8:
+            m.find_cell_at_point(5, y).pass_consumption = 100
+
+    path = m.find_path((2, 2), (8, 2))
+    assert path is not None and path[-1] == (8, 2)
+    assert (5, 8) in path
+    assert sum(m.pass_cost(x, y) for x, y in path) == len(path)
+    assert m.find_path((2, 2), (8, 2), budget=5) is None
+
+    field = m.flow_field((8, 2))
+    assert m.flow_field((8, 2)) is field
+    assert field.cost(2, 2) == len(path)
+    x, y = 2, 2
+    walked = []
+    while (step := field.next_step(x, y)) is not None:
+        x, y = step
+        walked.append(step)
+    assert (x, y) == (8, 2) and (5, 8) in walked
+
+    m.find_cell_at_point(5, 2).pass_consumption = 1
+    assert m.flow_field((8, 2)) is not field
+    path = m.find_path((2, 2), (8, 2))
+    assert path is not None and len(path) == 6 and (5, 2) in path
+
+
+def test_beams():
+    world = World()
+    m = Map(30, 40, "m", Land(world))
+
+    def brute(x, y, dx, dy, length, radius):
+        norm = math.hypot(dx, dy)
+        ux, uy = dx / norm, dy / norm
+        cells = set()
+        for cy in range(m.row):
+            for cx in range(m.col):
+                t = min(max((cx - x) * ux + (cy - y) * uy, 0), length)
+                if (cx - x - ux * t) ** 2 + (cy - y - uy * t) ** 2 <= radius * radius:
+                    cells.add((cx, cy))
+        return cells
+
+    for args in [(5, 5, 3, 1, 20, 1), (20, 3, -1, 4, 15, 2), (0, 29, 1, -1, 50, 1.5), (10, 10, 0, 1, 8, 0)]:
+        cells = m.cells_on_beam(*args)
+        assert len(cells) == len(set(cells))
+        assert set(cells) == brute(*args)
+
+    shooter = Walker(world, m, 2, 2)
+    far = Walker(world, m, 12, 7)
+    near = Walker(world, m, 6, 4)
+    off = Walker(world, m, 6, 10)
+    targets = shooter[Positional].select_line_targets(20, far[Positional], 1)
+    assert targets == [shooter[Unit], near[Unit], far[Unit]]
+    assert off[Unit] not in targets
+
+
+def test_shapes():
+    world = World()
+    m = Map(20, 30, "m", Land(world))
+    assert circle(3) is circle(3)
+    assert len(circle(1)) == 5
+    assert (0, 0) not in ring(1, 2) and (2, 0) in ring(1, 2)
+    east = cone(4, quantize_direction(1, 0), DIRECTIONS // 4)
+    assert (3, 0) in east and (-3, 0) not in east and (3, 3) not in east
+    bar = rect(5, 1, quantize_direction(0, 1))
+    assert (0, 5) in bar and (1, 3) in bar and (2, 3) not in bar and (0, -1) not in bar
+
+    coords = m.coords_in_shape(1, 18, circle(3))
+    assert set(coords) == {
+        (x, y)
+        for x in range(30)
+        for y in range(20)
+        if (x - 1) ** 2 + (y - 18) ** 2 <= 9
+    }
+    assert len(coords) == len(set(coords))
+    assert [(c.x, c.y) for c in m.find_cells_within_circle(1, 18, 2.5)] == coords
+
+    inside = Walker(world, m, 7, 5)
+    behind = Walker(world, m, 3, 5)
+    assert m.units_in_shape(5, 5, east) == [inside[Unit]]
+    assert set(m.units_in_shape(5, 5, circle(2))) == {inside[Unit], behind[Unit]}
+    assert list(m.cells()) == [inside[Positional].loc(), behind[Positional].loc()]
+
+
+def test_terrain_layers(tmp_path):
+    import array, struct
+    from luluwaku.terrain import read_npy
+
+    world = World()
+    m = Map(100, 70, "m", Land(world))
+    costs = m.layers[PASS_COST]
+    version = m.terrain_version
+    costs.fill(20, 30, 40, 5, 4)
+    assert m.terrain_version > version
+    assert m.find_cell_at_point(20, 30).pass_consumption == 4
+    assert m.pass_cost(59, 34) == 4 and m.pass_cost(60, 34) == 1 and m.pass_cost(20, 35) == 1
+    assert list(m.cells()) == []
+
+    m.layers[ELEVATION].blit(68, 98, 3, [1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    assert m.layers[ELEVATION].read(67, 97, 3, 3).tolist() == [0.0, 0.0, 0.0, 0.0, 1.0, 2.0, 0.0, 4.0, 5.0]
+
+    for x, y in [(-1, 0), (0, -1), (m.col, 0), (0, m.row)]:
+        with pytest.raises(IndexError):
+            m.layers[PASS_COST].get(x, y)
+
+    # a 2x3 int16 array as written by numpy.save
+    header = "{'descr': '<i2', 'fortran_order': False, 'shape': (2, 3), }"
+    header = header.ljust(118) + "\n"
+    path = tmp_path / "flags.npy"
+    path.write_bytes(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode() + array.array("h", [1, 2, 3, 4, 5, 6]).tobytes())
+    assert read_npy(str(path)) == ((2, 3), array.array("h", [1, 2, 3, 4, 5, 6]))
+    m.layers[FLAGS].load(str(path), 10, 10)
+    assert m.layers[FLAGS].read(10, 10, 3, 2).tolist() == [1, 2, 3, 4, 5, 6]
+
+
+def test_map_files(tmp_path):
+    path = str(tmp_path / "campaign.map")
+    world = World()
+    source = Map(300, 200, "m", Land(world))
+    source.layers[PASS_COST].fill(0, 0, 200, 100, 3)
+    source.layers[ELEVATION].set(150, 250, 2.5)
+    source.save(path)
+
+    world = World()
+    m = Map.open(path, "m", Land(world))
+    assert (m.row, m.col) == (300, 200)
+    costs = m.layers[PASS_COST]
+    assert costs.chunks == {}
+    assert m.find_cell_at_point(10, 10).pass_consumption == 3
+    assert m.pass_cost(10, 150) == 1
+    assert m.layers[ELEVATION].get(150, 250) == 2.5
+    assert len(costs.chunks) == 1
+
+    walker = Walker(world)
+    Positional(m, walker[Unit]).set_pos(40, 40)
+    assert m.pass_cost(40, 40) == 3
+    costs.set(100, 5, 7)
+    assert m.release_chunks() == 2
+    # the occupied chunk and the written one stay
+    assert len(costs.chunks) == 2
+    assert m.pass_cost(100, 5) == 7 and m.pass_cost(10, 10) == 3
+
+    f = MapFile.open(path)
+    assert m.release_chunks(close=True) == 1
+    assert f.closed and path not in MapFile._open
+    assert m.layers[ELEVATION].get(150, 250) == 2.5
+    f = MapFile.open(path)
+    m.save(path)
+    assert f.closed
+    assert m.layers[ELEVATION].get(150, 250) == 2.5
+
+
+def test_field_of_view():
+    world = World()
+    m = Map(40, 80, "m", Land(world))
+    open_field = m.field_of_view(10, 10, 4)
+    assert open_field == {
+        (x, y) for x in range(6, 15) for y in range(6, 15) if (x - 10) ** 2 + (y - 10) ** 2 <= 16
+    }
+
+    # a wall on x == 12 hides what is straight behind it
+    for y in range(5, 16):
+        m.layers[FLAGS].set(12, y, OPAQUE)
+    fov = m.field_of_view(10, 10, 4)
+    assert (12, 10) in fov and (13, 10) not in fov and (11, 13) in fov
+
+    a = Walker(world, m, 10, 10)
+    b = Walker(world, m, 14, 10)
+    pos = a[Positional]
+    cells = pos.visible_cells()
+    assert pos.visible_cells() is cells
+    m.layers[FLAGS].set(70, 30, OPAQUE)
+    assert pos.visible_cells() is cells
+    assert not pos.can_see(14, 10) and not b[Positional].can_see(10, 10)
+
+    m.layers[FLAGS].fill(12, 5, 1, 11, 0)
+    assert pos.visible_cells() is not cells
+    assert pos.can_see(14, 10)
+    assert set(m.units_seeing(12, 10)) == {a[Unit], b[Unit]}
+    b[Board].apply_SIGHT_DIST(1)
+    assert m.units_seeing(10, 10) == [a[Unit]]
+    pos.set_pos(20, 20)
+    assert m.units_seeing(13, 10) == [b[Unit]]
+
+    # units that see further than the default are found too
+    c = Walker(world, m, 40, 10)
+    c[Board].apply_SIGHT_DIST(30)
+    assert m.max_sight() == 30 and c[Unit] in m.units_seeing(13, 10)
+    c[Board].apply_SIGHT_DIST(5)
+    c[Board].add_modifier(Modifier("SIGHT_DIST", percent=4, source=c))
+    assert m.max_sight() == 25 and c[Unit] in m.units_seeing(20, 10)
+    c[Board].remove_modifiers(c)
+    assert m.max_sight() == 8 and c[Unit] not in m.units_seeing(20, 10)
+
+
+def test_regions():
+    world = World()
+    m = Map(100, 100, "m", Land(world))
+    logs = []
+
+    def track(region: Region, name: str):
+        region.register_enter_events(lambda u, c: logs.append((name, "enter", (c.x, c.y))))
+        region.register_leave_events(lambda u, c: logs.append((name, "leave", (c.x, c.y))))
+        return m.add_region(region)
+
+    trap = track(RectRegion(10, 10, 29, 29), "trap")
+    pool = track(CircleRegion(30, 30, 5), "pool")
+    tri = track(PolygonRegion([(50, 50), (70, 50), (50, 70)]), "tri")
+    assert list(m.cells()) == []
+    assert m.regions_at(29, 29) == [trap, pool]
+    assert m.regions_at(55, 55) == [tri] and m.regions_at(65, 65) == []
+    # listeners are saved with the map
+    world.dirty = set()
+    trap.register_enter_events(print)
+    assert world.dirty == {m}
+    world.dirty = None
+
+    walker = Walker(world)
+    pos = Positional(m, walker[Unit])
+    pos.set_pos(5, 5)
+    pos.set_pos(12, 12)
+    pos.set_pos(13, 13)
+    pos.set_pos(28, 28)
+    pos.set_pos(33, 30)
+    pos.set_pos(55, 52)
+    assert logs == [
+        ("trap", "enter", (12, 12)),
+        ("pool", "enter", (28, 28)),
+        ("trap", "leave", (28, 28)),
+        ("pool", "leave", (33, 30)),
+        ("tri", "enter", (55, 52)),
+    ]
+    m.remove_region(tri)
+    pos.set_pos(0, 0)
+    assert logs[-1] == ("tri", "enter", (55, 52))
+
+
+def test_commit_path():
+    world = World()
+    m = Map(20, 20, "m", Land(world))
+    logs = []
+    m.find_cell_at_point(2, 0).register_enter_events(lambda u, c: logs.append(("enter", c.x, u[Positional]._X)))
+    m.find_cell_at_point(2, 0).register_leave_events(lambda u, c: logs.append(("leave", c.x)))
+    zone = m.add_region(RectRegion(3, 0, 4, 0))
+    zone.register_enter_events(lambda u, c: logs.append(("zone in", c.x)))
+    zone.register_leave_events(lambda u, c: logs.append(("zone out", c.x)))
+    m.find_cell_at_point(4, 0).pass_consumption = 3
+
+    walker = Walker(world)
+    pos = Positional(m, walker[Unit])
+    pos.set_pos(0, 0)
+    board = walker[Board]
+    assert board.EFFORTS == 10
+    path = [(x, 0) for x in range(1, 9)]
+    # 1 + 1 + 1 + 3 + 1 + 1 + 1 = 9 < 10, the next step would leave nothing
+    assert pos.commit_path(path, board) == 7
+    assert board.EFFORTS == 1
+    assert (pos._X, pos._Y) == (7, 0)
+    assert m.find_cell_at_point(0, 0).contained_units == set()
+    assert [c.x for c in m.cells() if c.contained_units] == [7]
+    # listeners on the way see the unit at the end of the path
+    assert logs == [("enter", 2, 7), ("leave", 2), ("zone in", 3), ("zone out", 4)]
+    assert pos.commit_path(path, board) == 0
+
+
+def test_simultaneous_moves():
+    from luluwaku.actions.movement import MoveTo
+
+    def run(order):
+        world = World()
+        m = Map(10, 10, "m", Land(world))
+        a = Walker(world, m, 0, 0)
+        b = Walker(world, m, 2, 0)
+        # c follows a, d and e swap places
+        c = Walker(world, m, 0, 1)
+        d = Walker(world, m, 5, 5)
+        e = Walker(world, m, 6, 5)
+        intents = {
+            a: [(1, 0), (1, 1)],
+            b: [(1, 0)],
+            c: [(0, 0)],
+            d: [(6, 5)],
+            e: [(5, 5)],
+        }
+        for w in order(list(intents)):
+            world.intend_move(w[Positional], intents[w], w[Board])
+        world.judge()
+        return [(w[Positional]._X, w[Positional]._Y) for w in (a, b, c, d, e)]
+
+    forward = run(lambda ws: ws)
+    assert forward == run(lambda ws: ws[::-1])
+    assert forward == [(1, 1), (2, 0), (0, 0), (5, 5), (6, 5)]
+
+    world = World()
+    m = Map(10, 10, "m", Land(world))
+    w = Walker(world, m, 0, 0)
+    w[Board].apply_DEX(20)
+    MoveTo(w[Unit], 3, 0).submit(world)
+    world.judge()
+    assert (w[Positional]._X, w[Positional]._Y) == (3, 0)
+    assert w[Board].EFFORTS == 7
+
+    # a target off the map is walked towards until the edge
+    w = Walker(world, m, 0, 5)
+    w[Board].apply_DEX(20)
+    MoveTo(w[Unit], 22, 5).submit(world)
+    world.judge()
+    assert w[Positional]._X == 6 and w[Board].EFFORTS == 4
+    MoveTo(w[Unit], 9, -3).submit(world)
+    world.judge()
+    assert (w[Positional]._X, w[Positional]._Y) == (9, 0)
+
+
+def test_range_table():
+    world = World()
+    m = Map(50, 50, "m", Land(world))
+    ws = [Walker(world, m, x, y) for x, y in [(0, 0), (3, 4), (10, 0), (0, 6)]]
+    units = [w[Unit] for w in ws]
+    table = m.range_table()
+    assert m.range_table() is table and table.units == units
+    assert table.distance(units[0], units[1]) == 5.0
+    assert table.matrix()[2][0] == 10.0
+    assert table.within(units[0], 6) == [True, True, False, True]
+    assert ws[0][Positional].units_in_range(5) == units[:2]
+    assert table.nearest(units[0], 2) == [units[1], units[3]]
+
+    ws[2][Positional].set_pos(1, 1)
+    assert m.range_table() is not table
+    assert m.range_table().nearest(units[0], 1) == [units[2]]
+    table = m.range_table()
+    world.judge()
+    assert m.range_table() is not table
+
+    stray = Walker.__new__(Walker)
+    Entity.__init__(stray, world)
+    Positional(m, stray[Unit])
+    assert stray[Positional].units_in_range(100) == []
+    assert m.range_table().nearest(stray[Unit], 1) == []
+    assert stray[Positional].distance_to(ws[0][Positional]) == math.inf
+    assert ws[0][Positional].distance_to(ws[1][Positional]) == 5.0
+
+    # a despawned unit leaves the map
+    left = []
+    zone = m.add_region(RectRegion(0, 0, 3, 3))
+    zone.register_leave_events(lambda u, c: left.append(u))
+    ws[0][Positional].set_pos(1, 1)
+    world.despawn(ws[0])
+    assert left == [units[0]] and m.find_cell_at_point(1, 1).contained_units == {units[2]}
+    assert m.units_in_radius(1, 1, 2) == [units[2]]
+    assert units[0] not in m.range_table().units
+    world.judge()
@@ -0,0 +1,44 @@
+from luluwaku.core import *
+
+
+def test_query():
+    class Walker(Entity):
+        __components__ = (Unit, Board, DamanageAccepter)
+
+    class Statue(Entity):
+        __components__ = (Unit, Board)
+
+    class Rock(Entity):
+        __components__ = (Board,)
+
+    world = World()
+    walkers = []
+    for _ in range(3):
+        e = Walker(world)
+        e[Unit], e[Board]
+        walkers.append(e)
+
+    statue = Statue(world)
+    statue[Unit], statue[Board]
+
+    rock = Rock(world)
+    rock[Board]
+
+    rows = list(world.query(Unit, Board))
+    assert [u.entity for u, _ in rows] == walkers + [statue]
+    assert all(b is u.entity[Board] for u, b in rows)
+
+    # components that were never created do not match
+    assert list(world.query(DamanageAccepter)) == []
+    walkers[1][DamanageAccepter]
+    assert [da.entity for da, in world.query(DamanageAccepter)] == [walkers[1]]
+
+    world.despawn(walkers[0])
+    assert [u.entity for u, _ in world.query(Unit, Board)] == [
+        walkers[2],
+        walkers[1],
+        statue,
+    ]
+    assert walkers[2][Board].entity is walkers[2]
+    # a despawned entity keeps no row of its former archetype
+    assert not hasattr(walkers[0], "_archetype") and not hasattr(walkers[0], "_row")
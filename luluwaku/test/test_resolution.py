@@ -23,3 +23,11 @@ def test_resolution():
     assert E.__metadata__.indices[A] == array.array("i", sorted([i_A, i_B]))
     assert E.__metadata__.indices[B] == array.array("i", [i_B])
     assert E.__metadata__.indices[C] == array.array("i", sorted([i_B, i_C]))
+
+    assert E.__metadata__.slots == {B: i_B}
+
+    e = E()
+    b = e[B]
+    assert E.__metadata__.accessors[B](e) is b
+    assert E.__metadata__.accessors[A](e) is b
+    assert e.get_component(C) is b
@@ -0,0 +1,37 @@
+import os
+from luluwaku.core import *
+from luluwaku.runner import WorldPool
+
+
+class Player(Entity):
+    __components__ = (Unit, Board)
+
+
+def make_room(room: str) -> World:
+    world = World(seed=len(room))
+    Player(world)[Unit].uname = room
+    return world
+
+
+def describe(world: World):
+    (unit,) = [u for u, in world.query(Unit)]
+    return unit.uname, world.tick, os.getpid()
+
+
+def test_world_pool():
+    rooms = [f"room{i}" for i in range(6)]
+    with WorldPool(make_room, shards=2) as pool:
+        for room in rooms:
+            pool.judge(room)
+        ticks = {room: f.result() for room, f in pool.judge_all(rooms).items()}
+        assert ticks == {room: 2 for room in rooms}
+
+        results = {room: pool.submit(room, describe).result() for room in rooms}
+        for room, (uname, tick, pid) in results.items():
+            assert uname == room
+            assert tick == 2
+            assert pid != os.getpid()
+
+        assert len({pid for _, _, pid in results.values()}) <= 2
+        assert pool.close(rooms[0]).result()
+        assert pool.submit(rooms[0], describe).result()[1] == 0
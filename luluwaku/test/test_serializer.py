@@ -0,0 +1,89 @@
+import os
+import pickle
+import pytest
+import array
+import collections
+from luluwaku.core import *
+from luluwaku import serializer
+
+
+class Point:
+    def __init__(self, x, y, tag):
+        self.x = x
+        self.y = y
+        self.tag = tag
+
+
+def scale(k):
+    return lambda x: k * x
+
+
+def test_roundtrip():
+    shared = [1, 2.5, "s"]
+    cyclic: list = []
+    cyclic.append(cyclic)
+    value = {
+        "ints": [0, 127, 128, -1, 2**70],
+        "shared": (shared, shared),
+        "cyclic": cyclic,
+        "set": {1, 2},
+        "frozen": frozenset(["a"]),
+        "deque": collections.deque([1, 2]),
+        "array": array.array("d", [1.0, 2.0]),
+        "plist": PList.create(2, 1),
+        "type": Map,
+        "func": print,
+        "points": [Point(1.5, True, "a"), Point(2.5, False, None), Point(1, 2, 3)],
+    }
+    out = serializer.loads(serializer.dumps(value))
+    assert out["ints"] == value["ints"]
+    assert out["shared"][0] is out["shared"][1] == shared
+    assert out["cyclic"][0] is out["cyclic"]
+    assert out["set"] == {1, 2} and out["frozen"] == frozenset(["a"])
+    assert out["deque"] == collections.deque([1, 2])
+    assert out["array"] == value["array"]
+    assert list(out["plist"]) == [2, 1]
+    assert out["type"] is Map and out["func"] is print
+    assert [(p.x, p.y, p.tag) for p in out["points"]] == [
+        (1.5, True, "a"),
+        (2.5, False, None),
+        (1, 2, 3),
+    ]
+
+
+def test_functions():
+    pytest.importorskip("dill")
+    offset = 2
+    double = scale(2)
+    value = [scale, double, lambda x: x + offset, double]
+    out = serializer.loads(serializer.dumps(value))
+    assert out[0] is scale
+    assert out[1](3) == 6 and out[2](3) == 5
+    assert out[1] is out[3]
+
+
+def test_loadable_names():
+    class Local:
+        pass
+
+    with pytest.raises(ValueError):
+        serializer.loads(serializer.dumps(os.system))
+    # an unregistered local class is saved by value, if at all
+    try:
+        assert serializer.loads(serializer.dumps(Local)) is not Local
+    except (ValueError, pickle.PicklingError, AttributeError):
+        pass
+    serializer.register(Local)
+    assert serializer.loads(serializer.dumps(Local)) is Local
+
+    class Tagged(Item):
+        pass
+
+    # subclasses of registered types are found by name, local ones too
+    assert serializer.loads(serializer.dumps(Tagged)) is Tagged
+
+
+def test_refs():
+    anchor = object()
+    data = serializer.dumps([anchor, [anchor]], lambda o: "anchor" if o is anchor else None)
+    assert serializer.loads(data, lambda r: r.upper()) == ["ANCHOR", ["ANCHOR"]]
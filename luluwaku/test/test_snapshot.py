@@ -0,0 +1,160 @@
+import os
+from luluwaku.core import *
+from luluwaku import snapshot
+from luluwaku.items.weapons.normal_sword import NormalSword
+from luluwaku.items.books.fireball import FireBall
+from luluwaku.actions import transaction
+
+
+class Land(Entity):
+    __components__ = (Map,)
+
+
+class Hero(Entity):
+    __components__ = (Unit, Board, Positional, Bag, Caster, DamanageAccepter)
+
+    def __init__(self, world: World, m: Map, uname: str):
+        Entity.__init__(self, world)
+        self[Unit].uname = uname
+        Positional(m, self[Unit]).set_pos(1, 1)
+
+
+def test_snapshot(tmp_path):
+    path = os.path.join(tmp_path, "save")
+    world = World(seed=1)
+    m = Map(20, 20, "m", Land(world))
+    a = Hero(world, m, "a")
+    b = Hero(world, m, "b")
+    sword = NormalSword(1)
+    a[Bag].add_item(sword)
+    Group(a[Unit], "g")
+
+    writer = snapshot.SnapshotWriter(world, path, compact_ratio=100)
+    writer.autosave()
+    base_size = os.path.getsize(path)
+
+    a[Bag].add_money(12)
+    m.find_cell_at_point(5, 6).pass_consumption = 7
+    b[Positional].set_pos(3, 4)
+    world.judge()
+    # only the touched components and cells are written
+    assert os.path.getsize(path) - base_size < base_size
+
+    Group.join(b[Unit], a[Unit].group)
+    c = Hero(world, m, "c")
+    world.judge()
+
+    loaded = snapshot.load(path)
+    assert loaded.tick == 2
+    la, lb, lc = (loaded.entities[e.eid] for e in (a, b, c))
+    assert la[Bag].money == 12
+    assert [type(item) for item in la[Bag].all_items()] == [NormalSword]
+    assert (lb[Positional]._X, lb[Positional]._Y) == (3, 4)
+    lm = lb[Positional].map
+    assert lm.find_cell_at_point(3, 4).contained_units == {lb[Unit]}
+    assert lm.find_cell_at_point(1, 1).contained_units == {la[Unit], lc[Unit]}
+    assert set(lm.units_in_radius(1, 1, 0)) == {la[Unit], lc[Unit]}
+    assert lm.pass_cost(5, 6) == 7 and lm.pass_cost(6, 5) == 1
+    assert lc[Unit].uname == "c"
+    assert loaded.groups["g"] is la[Unit].group is lb[Unit].group
+    assert loaded.groups["g"].units == [la[Unit], lb[Unit]]
+    assert [u for u, in loaded.query(Unit)] == [la[Unit], lb[Unit], lc[Unit]]
+
+    writer.write_base()
+    assert len(list(snapshot.read_records(path))) == 1
+    assert snapshot.load(path).entities[b.eid][Positional]._Y == 4
+    writer.close()
+
+
+events: list[typing.Any] = []
+
+
+def on_die():
+    events.append("dead")
+
+
+def test_snapshot_functions():
+    world = World(seed=1)
+    m = Map(20, 20, "m", Land(world))
+    a = Hero(world, m, "a")
+    b = Hero(world, m, "b")
+    b[Positional].set_pos(4, 1)
+    a[Board].apply_SPR(10)
+    for each in (a, b):
+        each[Board].apply_CON(100)
+        each[Board].apply_HP(100)
+    b[DamanageAccepter].set_enable(True)
+    Group(a[Unit], "ga")
+    Group(b[Unit], "gb")
+    b[Board].on_death += on_die
+    m.find_cell_at_point(2, 2).register_enter_events(lambda u, c: events.append(u.uname))
+    region = RectRegion(5, 5, 6, 6)
+    m.add_region(region)
+    region.register_enter_events(lambda u, c: events.append(c.x))
+
+    fireball = FireBall()
+    a[Caster].learn(fireball)
+    fireball.cast(a[Unit], b).submit(world)
+    cost = transaction.Data()
+    cost.money, cost.items = 3, set()
+    gain = transaction.Data()
+    gain.money, gain.items = 0, set()
+    a[Bag].add_money(5)
+    trade = transaction.Create(a[Unit], b[Unit], cost, gain)
+    trade.submit(world)
+    ticket = trade.ticket_id
+
+    loaded = snapshot.loads(snapshot.dumps(world))
+    la, lb = (loaded.entities[e.eid] for e in (a, b))
+    hp = lb[Board].HP
+    loaded.judge()
+    # the fireball damage closure still reads the loaded caster's board
+    assert lb[Board].HP < hp
+    transaction.Shake(la[Unit], ticket).submit(loaded)
+    transaction.Shake(lb[Unit], ticket).submit(loaded)
+    loaded.judge()
+    loaded.judge()
+    assert (la[Bag].money, lb[Bag].money) == (2, 3)
+
+    lb[Positional].set_pos(2, 2)
+    lb[Positional].set_pos(5, 5)
+    lb[Board].on_death()
+    assert events == ["b", 5, "dead"]
+
+
+class Sleeper(Effect):
+    def __init__(self, n: int):
+        self.n = n
+        self.slept = False
+
+    def on_step(self) -> bool:
+        if self.slept:
+            events.append(self.n)
+            return False
+        self.slept = True
+        return self.wait(("wake", self.n), timeout=100)
+
+
+def test_snapshot_idle_world(tmp_path):
+    path = os.path.join(tmp_path, "save")
+    events.clear()
+    world = World(seed=1)
+    for n in range(100):
+        Sleeper(n).submit(world)
+    writer = snapshot.SnapshotWriter(world, path, compact_ratio=100)
+    writer.autosave()
+    for _ in range(11):
+        world.judge()
+    world.signal(("wake", 3))
+    world.judge()
+    sizes = [len(data) for _, data in snapshot.read_records(path)]
+    # the parked effects are only written when they park and when one wakes
+    assert max(sizes[2:-1]) * 10 < min(sizes[1], sizes[-1])
+
+    loaded = snapshot.load(path)
+    assert loaded.tick == 12 and loaded._timers.tick == 12
+    assert len(loaded._parked) == 99 and events == [3]
+    while loaded.tick <= 101:
+        loaded.judge()
+    assert sorted(events) == list(range(100))
+    writer.close()